@@ -0,0 +1,171 @@
+import math
+import numpy as np
+
+HEURISTICS = ("bottom_left", "best_short_side_fit", "best_area_fit")
+SORT_ORDERS = ("max_side", "area", "height", "none")
+
+
+class MaxRectsPacker:
+    # MaxRects bin packer: keeps every maximal free rectangle of the bin, places each rectangle in the free one the
+    # heuristic scores best and splits every free rectangle the placement overlaps. Free rectangles live in one
+    # (n, 4) array of x, y, width, height so scoring, splitting and pruning are vectorized.
+    def __init__(self, width, height, heuristic="bottom_left", allow_rotation=False):
+        if heuristic not in HEURISTICS:
+            raise ValueError(f"unknown packing heuristic: {heuristic!r}")
+        self.width = width
+        self.height = height
+        self.heuristic = heuristic
+        self.allow_rotation = allow_rotation
+        self.free = np.array([[0, 0, width, height]], dtype=np.int64)
+
+    def insert(self, width, height):
+        # Returns (x, y, rotated) or None when the rectangle fits nowhere
+        best = self._best(width, height)
+        rotated = False
+        if self.allow_rotation and width != height:
+            turned = self._best(height, width)
+            if turned is not None and (best is None or turned[0] < best[0]):
+                best, rotated = turned, True
+        if best is None:
+            return None
+        _, x, y = best
+        if rotated:
+            width, height = height, width
+        self._place(x, y, width, height)
+        return x, y, rotated
+
+    def _best(self, width, height):
+        # (score, x, y) of the best free rectangle for width x height, lower scores are better
+        x, y, free_width, free_height = self.free.T
+        fits = np.flatnonzero((free_width >= width) & (free_height >= height))
+        if not len(fits):
+            return None
+        left_x, left_y = free_width[fits] - width, free_height[fits] - height
+        if self.heuristic == "best_short_side_fit":
+            primary, secondary = np.minimum(left_x, left_y), np.maximum(left_x, left_y)
+        elif self.heuristic == "best_area_fit":
+            primary, secondary = free_width[fits] * free_height[fits], np.minimum(left_x, left_y)
+        else:
+            primary, secondary = y[fits] + height, x[fits]
+        best = np.lexsort((secondary, primary))[0]
+        choice = fits[best]
+        return (int(primary[best]), int(secondary[best])), int(x[choice]), int(y[choice])
+
+    def _place(self, x, y, width, height):
+        free_x, free_y, free_width, free_height = self.free.T
+        free_right, free_bottom = free_x + free_width, free_y + free_height
+        right, bottom = x + width, y + height
+        hit = (free_x < right) & (free_right > x) & (free_y < bottom) & (free_bottom > y)
+        if not hit.any():
+            return
+
+        # Up to four maximal pieces of every overlapped free rectangle: left, right, above and below the placement
+        hx, hy, hr, hb = free_x[hit], free_y[hit], free_right[hit], free_bottom[hit]
+        pieces = np.concatenate([
+            np.stack([hx, hy, x - hx, hb - hy], axis=1),
+            np.stack([np.full_like(hx, right), hy, hr - right, hb - hy], axis=1),
+            np.stack([hx, hy, hr - hx, y - hy], axis=1),
+            np.stack([hx, np.full_like(hy, bottom), hr - hx, hb - bottom], axis=1),
+        ])
+        pieces = pieces[(pieces[:, 2] > 0) & (pieces[:, 3] > 0)]
+        kept = self.free[~hit]
+
+        # Only new pieces can be redundant: drop those inside a kept rectangle near the placement or inside another
+        # piece. Identical pieces contain each other, the one listed first survives.
+        kx, ky, kr, kb = kept[:, 0], kept[:, 1], kept[:, 0] + kept[:, 2], kept[:, 1] + kept[:, 3]
+        near = kept[(kx < hr.max()) & (kr > hx.min()) & (ky < hb.max()) & (kb > hy.min())]
+        redundant = _contains(near, pieces).any(axis=1)
+        among = _contains(pieces, pieces)
+        order = np.arange(len(pieces))
+        among &= ~((among & among.T) & (order[:, None] <= order[None, :]))
+        redundant |= among.any(axis=1)
+        self.free = np.concatenate([kept, pieces[~redundant]])
+
+
+def _contains(outer, inner):
+    # (len(inner), len(outer)) matrix, True where the inner rectangle lies inside the outer one
+    ix, iy = inner[:, 0, None], inner[:, 1, None]
+    ox, oy = outer[None, :, 0], outer[None, :, 1]
+    return ((ix >= ox) & (iy >= oy) & (ix + inner[:, 2, None] <= ox + outer[None, :, 2]) &
+            (iy + inner[:, 3, None] <= oy + outer[None, :, 3]))
+
+
+def sort_sizes(sizes, order="max_side"):
+    # Indices of sizes in packing order, biggest first
+    if order not in SORT_ORDERS:
+        raise ValueError(f"unknown sort order: {order!r}")
+    if order == "none":
+        return list(range(len(sizes)))
+    keys = {'max_side': lambda size: (max(size), min(size)), 'area': lambda size: (size[0] * size[1], max(size)),
+            'height': lambda size: (size[1], size[0])}[order]
+    return sorted(range(len(sizes)), key=lambda i: keys(sizes[i]), reverse=True)
+
+
+def pack(sizes, max_width, max_height, padding=0, heuristic="bottom_left", allow_rotation=False,
+         sort="max_side"):
+    # Packs (width, height) sizes into one atlas of at most max_width x max_height. The bin starts as narrow as the
+    # total area allows and only widens when needed, which keeps the atlas close to square. Returns
+    # (placements, (atlas_width, atlas_height), efficiency) with a (x, y, rotated) or None per size.
+    padded = [(width + padding, height + padding) for width, height in sizes]
+    order = sort_sizes(padded, sort)
+    total_area = sum(width * height for width, height in padded)
+    widest = max((min(size) if allow_rotation else size[0] for size in padded), default=0)
+    width = min(max_width + padding, max(widest, math.ceil(math.sqrt(total_area))))
+
+    while True:
+        packer = MaxRectsPacker(width, max_height + padding, heuristic, allow_rotation)
+        placements = [None] * len(sizes)
+        for i in order:
+            placements[i] = packer.insert(*padded[i])
+        if all(placements) or width >= max_width + padding:
+            break
+        width = min(max_width + padding, int(width * 1.25) + 1)
+
+    atlas_width = atlas_height = 0
+    for placement, (sprite_width, sprite_height) in zip(placements, sizes):
+        if placement is not None:
+            x, y, rotated = placement
+            if rotated:
+                sprite_width, sprite_height = sprite_height, sprite_width
+            atlas_width = max(atlas_width, x + sprite_width)
+            atlas_height = max(atlas_height, y + sprite_height)
+    placed_area = sum(width * height for placement, (width, height) in zip(placements, sizes) if placement)
+    area = atlas_width * atlas_height
+    return placements, (atlas_width, atlas_height), placed_area / area if area else 0.0
+
+
+def pack_pages(sizes, max_width, max_height, padding=0, heuristic="bottom_left", allow_rotation=False,
+               sort="max_side"):
+    # Packs sizes into as many atlases as it takes, each page holds what the previous ones left over. Returns
+    # (pages, oversized): every page is (indices, placements, atlas_size, efficiency), oversized lists the indices that
+    # do not fit even an empty page.
+    def fits(width, height):
+        return (width <= max_width and height <= max_height) or \
+            (allow_rotation and height <= max_width and width <= max_height)
+
+    remaining = [i for i, size in enumerate(sizes) if fits(*size)]
+    oversized = [i for i, size in enumerate(sizes) if not fits(*size)]
+    pages = []
+    while remaining:
+        # The largest remaining sprite always fits the empty bin, so every page places at least one
+        placements, atlas_size, efficiency = pack([sizes[i] for i in remaining], max_width, max_height, padding,
+                                                  heuristic, allow_rotation, sort)
+        pages.append(([i for i, placement in zip(remaining, placements) if placement is not None],
+                      [placement for placement in placements if placement is not None], atlas_size, efficiency))
+        remaining = [i for i, placement in zip(remaining, placements) if placement is None]
+    return pages, oversized
+
+
+def page_metadata(frames, image, atlas_size, page, page_count):
+    # TexturePacker style JSON hash for one page from (name, (x, y, rotated), (width, height), (offset_x, offset_y),
+    # source size) frames. Like TexturePacker, frame width and height are the sprite's own, a rotated frame covers
+    # height x width pixels of the atlas turned by 90 degrees clockwise, which loaders undo by turning it back
+    # counterclockwise. spriteSourceSize places a trimmed sprite within its untrimmed source.
+    metadata = {}
+    for name, (x, y, rotated), (width, height), (offset_x, offset_y), (source_width, source_height) in frames:
+        metadata[name] = {'frame': {'x': x, 'y': y, 'w': width, 'h': height}, 'rotated': rotated,
+                          'trimmed': (width, height) != (source_width, source_height),
+                          'spriteSourceSize': {'x': offset_x, 'y': offset_y, 'w': width, 'h': height},
+                          'sourceSize': {'w': source_width, 'h': source_height}, 'page': page}
+    return {'frames': metadata, 'meta': {'image': image, 'size': {'w': atlas_size[0], 'h': atlas_size[1]},
+                                         'scale': "1", 'page': page, 'pages': page_count}}
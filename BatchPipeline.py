@@ -0,0 +1,109 @@
+import queue
+import threading
+
+# Marks files that were decoded but dropped because the run stopped before they were computed
+_SKIPPED = object()
+
+
+class BatchPipeline:
+    # Overlaps decode, compute and encode across the files of a batch. Reader threads decode upcoming files into a
+    # bounded queue, one compute thread processes them and writer threads encode and save the results. PNG decoding
+    # and zlib release the GIL, so the batch takes about as long as its slowest stage instead of the sum of all three.
+    # At most depth images wait between two stages, which caps the memory of a run. zlib encoding is usually the
+    # slowest stage, so it gets two threads by default.
+    def __init__(self, readers=1, writers=2, depth=2):
+        self.readers = readers
+        self.writers = writers
+        self.depth = depth
+
+    def share(self, memory_budget):
+        # Memory budget of one image, when every image the pipeline can hold at once gets the same share: one per reader
+        # and writer, up to depth in each queue and the one being computed
+        return max(1, memory_budget // (self.readers + 2 * self.depth + 1 + self.writers))
+
+    def run(self, items, decode, compute, encode, canceled=None):
+        # Yields (item, output, error) in item order as the files finish: decode(item) -> compute(item, decoded) ->
+        # encode(item, computed) -> output. A failing stage skips the rest for that item and yields its exception.
+        # Once canceled() is true no new item is started, items already decoded are dropped.
+        items = list(items)
+        decoded = queue.Queue(self.depth)
+        computed = queue.Queue(self.depth)
+        done = queue.Queue()
+        stop = threading.Event()
+        lock = threading.Lock()
+        indices = iter(range(len(items)))
+
+        def stopped():
+            return stop.is_set() or bool(canceled and canceled())
+
+        def read():
+            while True:
+                # Checked before an index is taken, so the started items are always a prefix of the batch
+                with lock:
+                    index = None if stopped() else next(indices, None)
+                if index is None:
+                    break
+                try:
+                    decoded.put((index, None, decode(items[index])))
+                except Exception as e:
+                    decoded.put((index, e, None))
+            decoded.put(None)
+
+        def process():
+            remaining = self.readers
+            while remaining:
+                entry = decoded.get()
+                if entry is None:
+                    remaining -= 1
+                    continue
+                index, error, value = entry
+                if error is None:
+                    try:
+                        value = _SKIPPED if stopped() else compute(items[index], value)
+                    except Exception as e:
+                        error, value = e, None
+                computed.put((index, error, value))
+            for _ in range(self.writers):
+                computed.put(None)
+
+        def write():
+            while True:
+                entry = computed.get()
+                if entry is None:
+                    break
+                index, error, value = entry
+                if error is None and value is not _SKIPPED:
+                    try:
+                        value = _SKIPPED if stop.is_set() else encode(items[index], value)
+                    except Exception as e:
+                        error, value = e, None
+                done.put((index, error, value))
+            done.put(None)
+
+        threads = [threading.Thread(target=read, daemon=True) for _ in range(self.readers)]
+        threads.append(threading.Thread(target=process, daemon=True))
+        threads += [threading.Thread(target=write, daemon=True) for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+
+        finished = {}
+        next_index = 0
+        try:
+            remaining = self.writers
+            while remaining:
+                entry = done.get()
+                if entry is None:
+                    remaining -= 1
+                    continue
+                finished[entry[0]] = entry
+                while next_index in finished:
+                    index, error, value = finished.pop(next_index)
+                    next_index += 1
+                    if value is not _SKIPPED:
+                        yield items[index], value, error
+        finally:
+            # The caller may stop early: nothing new starts and whatever is in flight runs out. Every stage keeps
+            # consuming its input until the end markers arrive, so no thread stays blocked on a full queue.
+            stop.set()
+            for thread in threads:
+                thread.join()
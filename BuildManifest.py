@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+
+
+class BuildManifest:
+    # What every output of a directory was built from: a content hash of the input and a hash of the settings. A file
+    # whose input and settings still match and whose output still exists does not have to be processed again.
+    # Inputs are only re-read when their size or modification time changed since the hash was taken.
+    FILE_NAME = ".manifest.json"
+    # Bumped whenever the same input and settings would give a different output
+    VERSION = 1
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, directory, settings):
+        self.directory = directory
+        self.path = os.path.join(directory, self.FILE_NAME)
+        self.settings_hash = self.hash_settings(settings)
+        self.entries = {}
+        # Hashes taken by up_to_date, recorded once the output is written
+        self.pending = {}
+        try:
+            with open(self.path) as file:
+                manifest = json.load(file)
+            if manifest.get('version') == self.VERSION:
+                self.entries = manifest['entries']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    @staticmethod
+    def hash_settings(settings):
+        return hashlib.sha1(json.dumps(settings, sort_keys=True, default=list).encode()).hexdigest()
+
+    def content_hash(self, file, entry=None):
+        # (hash, size, mtime_ns), the recorded hash is reused while size and modification time are unchanged
+        stat = os.stat(file)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['hash'], stat.st_size, stat.st_mtime_ns
+        digest = hashlib.blake2b(digest_size=20)
+        with open(file, "rb") as handle:
+            for chunk in iter(lambda: handle.read(self.CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest(), stat.st_size, stat.st_mtime_ns
+
+    def up_to_date(self, file, output_path):
+        name = os.path.basename(output_path)
+        entry = self.entries.get(name)
+        if entry is not None and entry['input'] != os.path.abspath(file):
+            entry = None
+        self.pending[name] = self.content_hash(file, entry)
+        return (entry is not None and entry['settings'] == self.settings_hash and
+                entry['hash'] == self.pending[name][0] and os.path.exists(output_path))
+
+    def record(self, file, output_path):
+        name = os.path.basename(output_path)
+        content_hash, size, mtime_ns = self.pending.pop(name, None) or self.content_hash(file)
+        self.entries[name] = {'input': os.path.abspath(file), 'hash': content_hash, 'size': size,
+                              'mtime_ns': mtime_ns, 'settings': self.settings_hash}
+
+    def prune(self):
+        # Removes the outputs whose input no longer exists, returns their paths
+        pruned = []
+        for name, entry in list(self.entries.items()):
+            if not os.path.exists(entry['input']):
+                output_path = os.path.join(self.directory, name)
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                    pruned.append(output_path)
+                del self.entries[name]
+        return pruned
+
+    def save(self):
+        temp_path = self.path + ".partial"
+        with open(temp_path, "w") as file:
+            json.dump({'version': self.VERSION, 'entries': self.entries}, file, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+
+def run_incremental(files, output_path, settings, run):
+    # Only passes the files that changed since the last run to run(files), which returns an OperationResult, and
+    # keeps one manifest per output directory. output_path(file) is where file's output goes, or a list of paths when
+    # a file has several outputs. Unchanged files count as outputs of this run, outputs of deleted inputs are removed.
+    manifests = {}
+
+    def output_paths(file):
+        paths = output_path(file)
+        return [paths] if isinstance(paths, str) else paths
+
+    def manifest(path):
+        directory = os.path.dirname(path)
+        if directory not in manifests:
+            manifests[directory] = BuildManifest(directory, settings)
+        return manifests[directory]
+
+    # Every output is checked, so each manifest hashes the file and a file is unchanged only if all outputs are
+    unchanged = {file for file in files if
+                 all([manifest(path).up_to_date(file, path) for path in output_paths(file)])}
+    result = run([file for file in files if file not in unchanged])
+
+    outputs = set(result.outputs)
+    done = [file for file in files if file in unchanged or all(path in outputs for path in output_paths(file))]
+    for file in done:
+        # Unchanged inputs are recorded again too, a touched file then keeps its new modification time
+        for path in output_paths(file):
+            manifest(path).record(file, path)
+    pruned = []
+    for directory_manifest in manifests.values():
+        pruned += directory_manifest.prune()
+        directory_manifest.save()
+
+    result.files = list(files)
+    result.outputs = [path for file in done for path in output_paths(file)]
+    result.message += f" {len(unchanged)} unchanged file{'s' if len(unchanged) != 1 else ''} skipped"
+    result.message += f", {len(pruned)} stale output{'s' if len(pruned) != 1 else ''} removed." if pruned else "."
+    return result
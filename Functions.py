@@ -1,8 +1,9 @@
 import os
-from CustomWidgets import CustomMessageBox
 
 BG_COLOR = "#121212"
 FG_COLOR = "#EEEEEE"
+# Palette lookup tables persisted between sessions
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".pixel_image_manipulator", "cache")
 
 # Define sample palettes with names
 PALETTES = [
@@ -207,7 +208,13 @@ PALETTES = [
 ]
 
 
+def get_palette(name):
+    return next((p["colors"] for p in PALETTES if p["name"] == name), None)
+
+
 def export_message(files, message, dir=None):
+    # Imported here so that the processing modules stay importable without tkinter
+    from CustomWidgets import CustomMessageBox
     if files:
         if not dir:
             exported_dir = os.path.dirname(files[0])
@@ -220,3 +227,14 @@ def export_message(files, message, dir=None):
         custom_box = CustomMessageBox("Success", message, f"{exported_dir}", open_directory)
         custom_box.show()
 
+
+
+def show_result(result, dir=None):
+    # Surface an OperationResult from the processing core in the GUI
+    from tkinter import messagebox
+    for warning in result.warnings:
+        messagebox.showwarning("Warning", warning)
+    if result.failed:
+        messagebox.showerror("Error", "Some images could not be processed:\n" +
+                             "\n".join(f"{os.path.basename(file)}: {error}" for file, error in result.failed))
+    export_message(result.files, message=result.message, dir=dir)
@@ -1,105 +1,383 @@
-from tkinter import messagebox
-from PIL import Image, ImageDraw, ImageEnhance
+from PIL import Image, ImageEnhance
 import numpy as np
+import hashlib
+import json
 import os
 from collections import Counter
-from Functions import export_message
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import AtlasPacker
+from BatchPipeline import BatchPipeline
+from BuildManifest import run_incremental
+from PaletteCache import PaletteCache
+from PaletteIndex import PaletteIndex
+from Recorder import NULL_RECORDER, Recorder
+from StageCache import StageCache
+
+TRANSPARENT_COLOR = (1, 0, 1, 0)
+# Peak working memory of a file operation when no memory_budget is given, larger images are streamed in strips
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+# remove_img_background modes: clear every pixel of the most common color, or only the region of the most common
+# border color that is connected to the image border
+BACKGROUND_MODES = ("most_common", "border")
+# Pixelated output: 8 bits per channel, or a palette PNG with one entry per color of the result
+OUTPUT_FORMATS = ("rgba", "indexed")
+# Dithering of the block grid before the palette match: ordered with a Bayer matrix, or error diffusion
+DITHER_MODES = ("none", "bayer2", "bayer4", "bayer8", "floyd_steinberg", "atkinson")
+# (dx, dy, weight) of every cell the matching error of a block is pushed to, Atkinson drops a quarter of it
+ERROR_KERNELS = {'floyd_steinberg': ((1, 0, 7 / 16), (-1, 1, 3 / 16), (0, 1, 5 / 16), (1, 1, 1 / 16)),
+                 'atkinson': ((1, 0, 1 / 8), (2, 0, 1 / 8), (-1, 1, 1 / 8), (0, 1, 1 / 8), (1, 1, 1 / 8), (0, 2, 1 / 8))}
+
+
+class OperationCanceled(Exception):
+    pass
+
+
+class OperationResult:
+    # Structured outcome of a batch operation, returned to the caller instead of popping dialogs
+    def __init__(self, operation, files, output_directory, message=""):
+        self.operation = operation
+        self.files = list(files)
+        self.output_directory = output_directory
+        self.message = message
+        self.outputs = []
+        self.failed = []
+        self.skipped = []
+        self.warnings = []
+        self.canceled = False
+        # Recorder.snapshot() of the run when it was instrumented
+        self.metrics = None
+
+    def add_failure(self, file, error):
+        self.failed.append((file, f"{type(error).__name__}: {error}"))
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def to_dict(self):
+        return {'operation': self.operation, 'output_directory': self.output_directory, 'message': self.message,
+                'outputs': self.outputs, 'failed': [{'file': file, 'error': error} for file, error in self.failed],
+                'skipped': self.skipped, 'warnings': self.warnings, 'canceled': self.canceled, 'metrics': self.metrics}
+
 
 class ImageManipulator:
-    def __init__(self):
-        self.last_block_size = 0
-        self.closest_color_cache = defaultdict(dict)
-        self.average_colors = []
+    # An instance only holds the shared caches, every call keeps its data in locals. One instance can serve the preview,
+    # the export thread and thread pools at the same time.
+    def __init__(self, palette_cache=None, stage_cache=None):
+        self.closest_color_cache = palette_cache if palette_cache is not None else PaletteCache()
+        self.stage_cache = stage_cache if stage_cache is not None else StageCache()
+
     @staticmethod
-    def resize_images(files, output_directory, resize_percent):
+    def resize_images(files, output_directory, resize_percent, incremental=False):
+        # resize_percent is one factor, or a list of factors that are all made from a single decode of every file and
+        # saved to resized_images/<factor>x. incremental skips files whose input and factors match the manifests.
         resized_directory = output_directory + "/resized_images"
-        os.makedirs(resized_directory, exist_ok=True)
+        factors = list(resize_percent) if isinstance(resize_percent, (list, tuple)) else None
+        directories = [resized_directory] if factors is None else [f"{resized_directory}/{factor:g}x" for factor in
+                                                                   factors]
+        for directory in directories:
+            os.makedirs(directory, exist_ok=True)
+
+        def output_paths(file):
+            paths = [f"{directory}/{os.path.basename(file)}" for directory in directories]
+            return paths[0] if factors is None else paths
+
+        if incremental:
+            return run_incremental(files, output_paths, {'resize_percent': resize_percent},
+                                   lambda changed: ImageManipulator.resize_images(changed, output_directory,
+                                                                                  resize_percent))
+        result = OperationResult("resize", files, resized_directory, "Images resized and saved successfully.")
+        if factors is None:
+            return ImageManipulator.run_batch(result, files, resized_directory,
+                                              lambda img: ImageManipulator.scale_nearest(img, resize_percent))
+
+        def compute(file, img):
+            pixels = ImageManipulator.rgba_pixels(img) if any(factor > 2 for factor in factors) else None
+            return [ImageManipulator.scale_nearest(img, factor, pixels) for factor in factors]
+
+        # The variants of a file are encoded at the same time, zlib releases the GIL
+        with ThreadPoolExecutor(max_workers=len(factors)) as executor:
+            def encode(file, images):
+                paths = output_paths(file)
+                list(executor.map(lambda image, path: image.save(path), images, paths))
+                return paths
+
+            for file, outputs, error in BatchPipeline().run(files, ImageManipulator.open_image, compute, encode):
+                if error is None:
+                    result.outputs += outputs
+                else:
+                    result.add_failure(file, error)
+        return result
 
-        for file in files:
-            img = Image.open(file)
-            width, height = img.size
-            new_width = int(width * resize_percent)
-            new_height = int(height * resize_percent)
-            resized_img = img.resize((new_width, new_height), Image.NEAREST)
-            file_name = os.path.basename(file)
-            resized_img.save(f"{resized_directory}/{file_name}")
-        export_message(files, message="Images resized and saved successfully.")
+    @staticmethod
+    def rgba_pixels(image):
+        # (height, width) uint32 view of an RGBA image, None for other modes
+        return np.asarray(image).view(np.uint32)[:, :, 0] if image.mode == "RGBA" else None
 
     @staticmethod
-    def create_spritesheet(files, output_directory):
+    def scale_nearest(image, factor, pixels=None):
+        # Image.NEAREST resize by factor. Integer upscales of RGBA images from 3x on repeat whole uint32 pixels,
+        # columns first so the rows are plain copies, instead of going through the resampler. pixels can pass
+        # rgba_pixels(image) when several factors are made from one image. Pillow stays faster for 2x upscales and
+        # for downscales, where numpy strides do not beat its nearest resize.
+        width, height = image.size
+        size = (int(width * factor), int(height * factor))
+        scale = size[0] // width if width else 0
+        if image.mode == "RGBA" and scale > 2 and size == (width * scale, height * scale):
+            pixels = ImageManipulator.rgba_pixels(image) if pixels is None else pixels
+            pixels = np.repeat(np.repeat(pixels, scale, axis=1), scale, axis=0)
+            return Image.fromarray(pixels.view(np.uint8).reshape(size[1], size[0], 4))
+        return image.resize(size, Image.NEAREST)
+
+    @staticmethod
+    def run_batch(result, files, output_directory, process, streamed=None, memory_budget=None):
+        # Runs process(image) over the files in a BatchPipeline, so decoding the next files and encoding the previous
+        # ones overlap with it, and saves every result under output_directory with the file's name. Files above their
+        # share of the memory budget go to streamed(file, output_path, memory_budget) in the compute stage instead.
+        pipeline = BatchPipeline()
+        memory_budget = pipeline.share(memory_budget or DEFAULT_MEMORY_BUDGET)
+
+        def output_path(file):
+            return f"{output_directory}/{os.path.basename(file)}"
+
+        def decode(file):
+            if streamed is not None and ImageManipulator.should_tile(file, memory_budget):
+                return None
+            return ImageManipulator.open_image(file)
+
+        def compute(file, img):
+            if img is None:
+                return streamed(file, output_path(file), memory_budget)
+            return process(img)
+
+        def encode(file, img):
+            if img is not None:
+                img.save(output_path(file))
+            return output_path(file)
+
+        for file, output, error in pipeline.run(files, decode, compute, encode):
+            if error is None:
+                result.outputs.append(output)
+            else:
+                result.add_failure(file, error)
+        return result
+
+    @staticmethod
+    def create_spritesheet(files, output_directory, allow_rotation=False, heuristic="bottom_left", sort="max_side",
+                           trim=False, deduplicate=False):
         MAX_WIDTH = 3000
         MAX_HEIGHT = 6000
         PADDING = 5
+        result = OperationResult("spritesheet", files, output_directory, "Spritesheet exported successfully.")
+
+        if trim or deduplicate:
+            sprites, frame_sprites, offsets, source_sizes = ImageManipulator.prepare_sprites(files, trim, deduplicate)
+            sizes = [sprite.size for sprite in sprites]
+        else:
+            # The layout only needs the sizes, Image.open reads them from the header without decoding any pixels
+            sizes = []
+            for file in files:
+                with Image.open(file) as img:
+                    sizes.append(img.size)
+            sprites, frame_sprites, offsets, source_sizes = files, range(len(files)), [(0, 0)] * len(files), sizes
+        # Sprites that do not fit one page spill over to more pages instead of being dropped
+        pages, oversized = AtlasPacker.pack_pages(sizes, MAX_WIDTH, MAX_HEIGHT, PADDING, heuristic, allow_rotation,
+                                                  sort)
+        if oversized:
+            result.warnings.append(f"Images larger than {MAX_WIDTH}x{MAX_HEIGHT} were left out.")
+            oversized = set(oversized)
+            result.skipped.extend(file for file, sprite in zip(files, frame_sprites) if sprite in oversized)
+
+        # Frames are named after the file, or its full path when two files share a name. Duplicates share one rect.
+        names = [os.path.basename(file) for file in files]
+        counts = Counter(names)
+        names = [name if counts[name] == 1 else file for name, file in zip(names, files)]
+        sprite_frames = {}
+        for frame, sprite in enumerate(frame_sprites):
+            sprite_frames.setdefault(sprite, []).append(frame)
+
+        def export_page(page):
+            indices, placements, atlas_size, _ = pages[page]
+            stem = "spritesheet" if page == 0 else f"spritesheet_{page}"
+            spritesheet_path = output_directory + f"/{stem}.png"
+            ImageManipulator.render_atlas_page([sprites[i] for i in indices], placements, atlas_size).save(
+                spritesheet_path)
+            frames = [(names[frame], placement, sizes[i], offsets[frame], source_sizes[frame])
+                      for i, placement in zip(indices, placements) for frame in sprite_frames[i]]
+            metadata = AtlasPacker.page_metadata(frames, stem + ".png", atlas_size, page, len(pages))
+            with open(output_directory + f"/{stem}.json", "w") as file:
+                json.dump(metadata, file, indent=2)
+            return spritesheet_path
+
+        # Pages are independent, decoding, pasting and PNG encoding mostly release the GIL
+        if len(pages) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(pages), os.cpu_count() or 1)) as executor:
+                result.outputs.extend(executor.map(export_page, range(len(pages))))
+        else:
+            result.outputs.extend(export_page(page) for page in range(len(pages)))
+
+        placed_area = sum(sizes[i][0] * sizes[i][1] for indices, _, _, _ in pages for i in indices)
+        atlas_area = sum(width * height for _, _, (width, height), _ in pages)
+        if atlas_area:
+            result.message += f" {len(pages)} page{'s' if len(pages) > 1 else ''}, " \
+                              f"packing efficiency: {placed_area / atlas_area:.0%}."
+        if len(sprites) < len(files):
+            result.message += f" {len(files) - len(sprites)} duplicate sprites shared."
+        return result
 
-        current_x = 0
-        current_y = 0
-        max_row_height = 0
-        total_width = 0
-
+    @staticmethod
+    def prepare_sprites(files, trim=False, deduplicate=False):
+        # Decodes every file once and keeps the sprites to pack in memory: cropped to their alpha bounding box when
+        # trimming, and only the first of identical sprites when deduplicating. Returns (sprites, the sprite index of
+        # every file, the offset of each file's sprite in the file, the file sizes).
+        sprites, frame_sprites, offsets, source_sizes = [], [], [], []
+        seen = {}
         for file in files:
-            img = Image.open(file)
-            width, height = img.size
+            with Image.open(file) as img:
+                source_sizes.append(img.size)
+                sprite = img.convert("RGBA")
+            box = (0, 0) + sprite.size
+            if trim:
+                # A fully transparent sprite still keeps one pixel
+                box = sprite.getchannel("A").getbbox() or (0, 0, 1, 1)
+                sprite = sprite.crop(box)
+            offsets.append(box[:2])
+            key = (sprite.size, hashlib.blake2b(sprite.tobytes(), digest_size=16).digest()) if deduplicate else None
+            if key in seen:
+                frame_sprites.append(seen[key])
+                continue
+            if key is not None:
+                seen[key] = len(sprites)
+            frame_sprites.append(len(sprites))
+            sprites.append(sprite)
+        return sprites, frame_sprites, offsets, source_sizes
 
-            if current_x + width > MAX_WIDTH:
-                current_x = 0
-                current_y += max_row_height + PADDING
-                max_row_height = 0
+    @staticmethod
+    def render_atlas_page(sprites, placements, atlas_size):
+        # sprites are file paths, decoded here exactly once when pasted, or images prepared by prepare_sprites
+        spritesheet = Image.new("RGBA", atlas_size, (255, 255, 255, 0))
+        for sprite, (x, y, rotated) in zip(sprites, placements):
+            with Image.open(sprite) if isinstance(sprite, str) else nullcontext(sprite) as img:
+                if rotated:
+                    img = img.transpose(Image.Transpose.ROTATE_270)
+                spritesheet.paste(img, (x, y))
+        return spritesheet
 
-            if current_y + height > MAX_HEIGHT:
-                messagebox.showwarning("Warning", "Spritesheet maximum size reached. Some images may be cut off.")
-                break
+    @staticmethod
+    def tiled(memory_budget=None, canceled=None):
+        # Imported here, TiledProcessor builds on this module
+        from TiledProcessor import TiledProcessor
+        return TiledProcessor(memory_budget, canceled)
 
-            current_x += width + PADDING
-            max_row_height = max(max_row_height, height)
-            total_width = max(total_width, current_x)
+    @staticmethod
+    def should_tile(file, memory_budget=None):
+        from TiledProcessor import TiledProcessor
+        return TiledProcessor.should_tile(file, memory_budget)
 
-        spritesheet = Image.new("RGBA", (total_width, current_y + max_row_height), (255, 255, 255, 0))
-        draw = ImageDraw.Draw(spritesheet)
+    @staticmethod
+    def replace_color(files, output_directory, target_color, new_color, memory_budget=None):
+        return ImageManipulator.replace_colors(files, output_directory, {target_color: new_color}, memory_budget)
 
-        current_x = 0
-        current_y = 0
-        max_row_height = 0
+    @staticmethod
+    def replace_colors(files, output_directory, color_map, memory_budget=None):
+        # color_map is {source RGB: target RGB}, every substitution is applied in the same pass
+        replaced_directory = output_directory + "/replaced_images"
+        os.makedirs(replaced_directory, exist_ok=True)
+        result = OperationResult("replace", files, replaced_directory, "Color replaced and images saved successfully.")
+        color_table = ImageManipulator.color_map_table(color_map)
 
-        for file in files:
-            img = Image.open(file)
-            width, height = img.size
-            aspect_ratio = width / height
+        return ImageManipulator.run_batch(
+            result, files, replaced_directory, lambda img: ImageManipulator.map_colors(img, color_table),
+            lambda file, output_path, budget: ImageManipulator.tiled(budget).replace_colors(file, output_path,
+                                                                                            color_table),
+            memory_budget)
 
-            if current_x + width > MAX_WIDTH:
-                current_x = 0
-                current_y += max_row_height + PADDING
-                max_row_height = 0
+    @staticmethod
+    def color_map_table(color_map):
+        # Source colors packed into sorted uint32 keys, with the replacement color of each key
+        sources = np.array(list(color_map.keys()), dtype=np.uint32).reshape(-1, 3)
+        targets = np.array(list(color_map.values()), dtype=np.uint8).reshape(-1, 3)
+        keys = ImageManipulator._encode_color(sources.T)
+        order = np.argsort(keys, kind="stable")
+        return keys[order], targets[order]
 
-            spritesheet.paste(img, (current_x, current_y))
-            draw.rectangle([current_x, current_y, current_x + width - 1, current_y + height - 1], outline="black")
+    @staticmethod
+    def map_colors(image, color_table):
+        # Looks every pixel up in the sorted keys at once, alpha is kept as it is. Indexed images only have their
+        # palette rewritten.
+        palette = ImageManipulator.indexed_palette(image)
+        if palette is not None:
+            return ImageManipulator.with_palette(image, *ImageManipulator.map_palette(*palette, color_table))
+        data = np.array(image.convert("RGBA"))
+        ImageManipulator._map_rgb(data[:, :, :3], color_table)
+        return Image.fromarray(data)
 
-            current_x += width + PADDING
-            max_row_height = max(max_row_height, height)
+    @staticmethod
+    def _map_rgb(rgb, color_table):
+        # Replaces in place every (..., 3) RGB value that has a key in color_table
+        keys, targets = color_table
+        if not len(keys):
+            return
+        packed = ImageManipulator._encode_color(np.moveaxis(rgb, -1, 0).astype(np.uint32))
+        positions = np.minimum(np.searchsorted(keys, packed), len(keys) - 1)
+        found = keys[positions] == packed
+        rgb[found] = targets[positions[found]]
 
-        spritesheet_path = output_directory + "/spritesheet.png"
-        spritesheet.save(spritesheet_path)
-        export_message(files, message="Spritesheet exported successfully.")
+    @staticmethod
+    def map_palette(colors, alpha, color_table):
+        colors = colors.copy()
+        ImageManipulator._map_rgb(colors, color_table)
+        return colors, alpha
 
     @staticmethod
-    def replace_color(files, output_directory, target_color, new_color):
-        replaced_directory = output_directory + "/replaced_images"
-        os.makedirs(replaced_directory, exist_ok=True)
+    def remove_palette_color(colors, alpha, color):
+        mask = np.all(colors == color[:3], axis=-1)
+        colors, alpha = colors.copy(), alpha.copy()
+        colors[mask] = TRANSPARENT_COLOR[:3]
+        alpha[mask] = TRANSPARENT_COLOR[3]
+        return colors, alpha
 
-        for file in files:
-            img = Image.open(file)
-            img = img.convert("RGBA")
-            data = img.getdata()
-            newData = []
-            for item in data:
-                if item[:3] == target_color:
-                    newData.append(new_color + (item[3],))
-                else:
-                    newData.append(item)
-            img.putdata(newData)
-            file_name = os.path.basename(file)
-            img.save(f"{replaced_directory}/{file_name}")
-        export_message(files, message="Color replaced and images saved successfully.")
+    @staticmethod
+    def indexed_palette(image):
+        # Palette colors (N, 3) and alpha (N,) of a "P" image, None when the image has to take the pixel path
+        if image.mode != "P" or image.palette is None or image.palette.mode != "RGB":
+            return None
+        colors = np.array(image.getpalette("RGB"), dtype=np.uint8).reshape(-1, 3)
+        alpha = np.full(len(colors), 255, dtype=np.uint8)
+        transparency = image.info.get("transparency")
+        if isinstance(transparency, int) and transparency < len(colors):
+            alpha[transparency] = 0
+        elif isinstance(transparency, bytes):
+            entries = np.frombuffer(transparency, dtype=np.uint8)[:len(colors)]
+            alpha[:len(entries)] = entries
+        return colors, alpha
+
+    @staticmethod
+    def with_palette(image, colors, alpha):
+        # Same indices with a new palette, transparency is stored the way the PNG plugin reads it back
+        image = image.copy()
+        image.putpalette(colors.tobytes(), "RGB")
+        image.info.pop("transparency", None)
+        transparent = np.flatnonzero(alpha < 255)
+        if len(transparent) == 1 and alpha[transparent[0]] == 0:
+            image.info["transparency"] = int(transparent[0])
+        elif len(transparent):
+            image.info["transparency"] = alpha[:transparent[-1] + 1].tobytes()
+        return image
+
+    @staticmethod
+    def remove_color_images(files, output_directory, target_color, memory_budget=None):
+        removed_directory = output_directory + "/removed_images"
+        os.makedirs(removed_directory, exist_ok=True)
+        result = OperationResult("remove", files, removed_directory,
+                                 "Color removed from images and saved successfully.")
+
+        return ImageManipulator.run_batch(
+            result, files, removed_directory, lambda img: ImageManipulator.remove_color(img, target_color[:3]),
+            lambda file, output_path, budget: ImageManipulator.tiled(budget).remove_color(file, output_path,
+                                                                                          target_color),
+            memory_budget)
 
     @staticmethod
     def convert(photoimage):
@@ -107,10 +385,14 @@ class ImageManipulator:
 
     @staticmethod
     def remove_color(image, color):
-        TRANSPARENT_COLOR = (1, 0, 1, 0)
-        image_data = np.array(image)
-        mask = np.all(image_data[:, :, :3] == color[:3], axis=-1)
-        image_data[mask] = TRANSPARENT_COLOR
+        palette = ImageManipulator.indexed_palette(image)
+        if palette is not None:
+            return ImageManipulator.with_palette(image, *ImageManipulator.remove_palette_color(*palette, color))
+        image_data = np.array(image if image.mode == "RGBA" else image.convert("RGBA"))
+        # Whole pixels are compared and written as one uint32 instead of channel by channel
+        pixels = image_data.view(np.uint32)[:, :, 0]
+        mask = (pixels & ImageManipulator._rgba_word((255, 255, 255))) == ImageManipulator._rgba_word(color[:3])
+        pixels[mask] = ImageManipulator._rgba_word(TRANSPARENT_COLOR)
         return Image.fromarray(image_data)
 
 
@@ -125,14 +407,75 @@ class ImageManipulator:
         return Image.fromarray(data, "HSV").convert("RGB")
 
     @staticmethod
-    def adjust_contrast(image, contrast):
+    def adjust_contrast(image, contrast, mean=None):
         if contrast == 0:
             return image
 
-        enhancer = ImageEnhance.Contrast(image)
         # Convert contrast from a scale of -100 to 100 to a factor between 0 and 2
         contrast_factor = 1.0 + contrast / 100.0
-        return enhancer.enhance(contrast_factor)
+        if mean is None:
+            enhancer = ImageEnhance.Contrast(image)
+            return enhancer.enhance(contrast_factor)
+
+        # Same blend as ImageEnhance.Contrast, around a mean taken over more than this image (e.g. a whole tiled image)
+        degenerate = Image.new("L", image.size, mean)
+        if image.mode != "L":
+            degenerate = degenerate.convert(image.mode)
+        if "A" in image.getbands():
+            degenerate.putalpha(image.getchannel("A"))
+        return Image.blend(degenerate, image, contrast_factor)
+
+    @staticmethod
+    def contrast_mean(histogram):
+        # Rounded mean of an "L" histogram, as ImageEnhance.Contrast computes it
+        histogram = np.asarray(histogram, dtype=np.int64)
+        return int(int((np.arange(256) * histogram).sum()) / int(histogram.sum()) + 0.5)
+
+    @staticmethod
+    def adjust_grid(grid, saturation=0, brightness=0, contrast=0, weights=None, mean=None):
+        # Same result as adjust_saturation, adjust_brightness and adjust_contrast on the expanded image. They are all
+        # per pixel and every output pixel is a copy of one cell, so they run on the grid instead. Brightness and
+        # contrast are fused into one 256 entry LUT, the contrast mean weights each cell by the pixels it becomes.
+        grid = ImageManipulator.adjust_saturation(grid, saturation)
+        if brightness == 0 and contrast == 0:
+            return grid
+        lut = ImageManipulator.brightness_lut(brightness)
+        if contrast != 0:
+            if mean is None:
+                mean = ImageManipulator.contrast_mean(ImageManipulator.luminance_histogram(grid, lut, weights))
+            lut = ImageManipulator.contrast_lut(contrast, mean)[lut]
+        return ImageManipulator.apply_lut(grid, lut)
+
+    @staticmethod
+    def brightness_lut(brightness):
+        # ImageEnhance.Brightness applied to every 8-bit value, alpha is blended with itself and never changes
+        return ImageManipulator._blend_lut(0, 1.0 + brightness / 100.0)
+
+    @staticmethod
+    def contrast_lut(contrast, mean):
+        return ImageManipulator._blend_lut(mean, 1.0 + contrast / 100.0)
+
+    @staticmethod
+    def _blend_lut(degenerate, factor):
+        # Image.blend treats every channel byte alike, so blending a 0..255 ramp gives its exact per-value table
+        ramp = Image.fromarray(np.arange(256, dtype=np.uint8)[None, :])
+        return np.asarray(Image.blend(Image.new("L", ramp.size, degenerate), ramp, factor))[0]
+
+    @staticmethod
+    def apply_lut(grid, lut):
+        data = np.array(grid)
+        data[:, :, :3] = lut[data[:, :, :3]]
+        return Image.fromarray(data)
+
+    @staticmethod
+    def luminance_histogram(grid, lut=None, weights=None):
+        # "L" histogram of the grid after lut, counting every cell as many times as weights says
+        if lut is not None:
+            grid = ImageManipulator.apply_lut(grid, lut)
+        luminance = np.asarray(grid.convert("L")).ravel()
+        if weights is None:
+            return np.bincount(luminance, minlength=256)
+        return np.bincount(luminance, weights=np.ravel(weights), minlength=256).round().astype(np.int64)
 
     @staticmethod
     def adjust_brightness(image, brightness):
@@ -145,18 +488,103 @@ class ImageManipulator:
         return enhancer.enhance(brightness_factor)
 
     @staticmethod
-    def remove_img_background(image):
+    def remove_img_background(image, mode="most_common"):
         image = image.convert("RGBA")
-        pixels = image.getdata()
-        color_counts = Counter(pixels)
-        max_color = color_counts.most_common(1)[0][0]
-        return ImageManipulator.remove_color(image, max_color)
+        if mode == "most_common":
+            return ImageManipulator.remove_color(image, ImageManipulator.most_common_color(image))
+        if mode != "border":
+            raise ValueError(f"unknown background mode: {mode!r}")
+        packed = ImageManipulator.pack_rgba(image)
+        border = np.concatenate([packed[0], packed[-1], packed[1:-1, 0], packed[1:-1, -1]])
+        key = ImageManipulator._most_common_packed(border)
+        # Colors match on RGB like remove_color
+        mask = (packed >> np.uint32(8)) == np.uint32(key >> 8)
+        data = np.array(image)
+        pixels = data.view(np.uint32)[:, :, 0]
+        pixels[ImageManipulator.connected_to_border(mask)] = ImageManipulator._rgba_word(TRANSPARENT_COLOR)
+        return Image.fromarray(data)
+
+    @staticmethod
+    def pack_rgba(image):
+        # Every pixel of an RGBA image as one uint32, red in the top byte
+        data = np.ascontiguousarray(np.asarray(image))
+        return data.view(">u4").reshape(data.shape[:2]).astype(np.uint32)
+
+    @staticmethod
+    def _rgba_word(color):
+        # The uint32 an RGBA pixel of this color reads as in native byte order, missing channels are 0
+        return np.array(tuple(color) + (0,) * (4 - len(color)), dtype=np.uint8).view(np.uint32)[0]
+
+    @staticmethod
+    def unpack_rgba(key):
+        return (key >> 24) & 255, (key >> 16) & 255, (key >> 8) & 255, key & 255
+
+    @staticmethod
+    def most_common_color(image):
+        return ImageManipulator.unpack_rgba(ImageManipulator._most_common_packed(
+            ImageManipulator.pack_rgba(image.convert("RGBA")).ravel()))
+
+    @staticmethod
+    def _most_common_packed(packed, sample_size=65536, candidates=16):
+        # Exact most common key, ties go to the key seen first like Counter.most_common. The leaders of a strided
+        # sample are counted exactly, and if the best of them outnumbers all pixels outside the candidates together no
+        # other key can beat it. Only otherwise is every key counted.
+        sample = packed[::max(1, len(packed) // sample_size)]
+        sample_keys, sample_counts = np.unique(sample, return_counts=True)
+        keys = np.sort(sample_keys[np.argsort(sample_counts, kind="stable")[::-1][:candidates]])
+        positions = np.minimum(np.searchsorted(keys, packed), len(keys) - 1)
+        found = keys[positions] == packed
+        counts = np.bincount(positions[found], minlength=len(keys))
+        best = counts.max()
+        if best <= len(packed) - counts.sum():
+            keys, counts = np.unique(packed, return_counts=True)
+            best = counts.max()
+        best_keys = keys[counts == best]
+        if len(best_keys) > 1:
+            return int(packed[np.flatnonzero(np.isin(packed, best_keys))[0]])
+        return int(best_keys[0])
+
+    @staticmethod
+    def connected_to_border(mask):
+        # Pixels of mask reachable from the image border through 4-connected pixels of mask. Whole row runs and column
+        # runs are spread alternately until nothing changes, a few passes for the outlines sprites have.
+        columns_mask = np.ascontiguousarray(mask.T)
+        row_runs, column_runs = ImageManipulator._runs(mask), ImageManipulator._runs(columns_mask)
+        reached = np.zeros_like(mask)
+        reached[[0, -1], :] = mask[[0, -1], :]
+        reached[:, [0, -1]] |= mask[:, [0, -1]]
+        while True:
+            spread = ImageManipulator._spread_runs(reached, row_runs)
+            spread = ImageManipulator._spread_runs(np.ascontiguousarray(spread.T), column_runs)
+            spread = np.ascontiguousarray(spread.T)
+            if np.array_equal(spread, reached):
+                return reached
+            reached = spread
 
     @staticmethod
-    def closest_color(pixel, palette):
+    def _runs(mask):
+        # Starts and lengths of the runs of equal values along each row, rows never share a run
+        flat = mask.ravel()
+        changes = np.ones(flat.shape, dtype=bool)
+        changes[1:] = flat[1:] != flat[:-1]
+        changes[::mask.shape[1]] = True
+        starts = np.flatnonzero(changes)
+        return starts, np.diff(np.append(starts, flat.size))
+
+    @staticmethod
+    def _spread_runs(reached, runs):
+        # Marks every run that holds a reached pixel. reached only ever covers runs of the mask, so runs outside the
+        # mask stay unmarked.
+        starts, lengths = runs
+        return np.repeat(np.logical_or.reduceat(reached.ravel(), starts), lengths).reshape(reached.shape)
+
+    @staticmethod
+    def closest_color(pixel, palette, metric="rgb"):
         if len(pixel) > 3:
             if pixel[3] == 0:
                 return pixel
+        if metric != "rgb":
+            return palette[PaletteIndex(palette, metric=metric).nearest(pixel[:3])[0]]
         pixel_rgb = np.array(pixel[:3])
         palette_array = np.array(palette)
 
@@ -174,60 +602,382 @@ class ImageManipulator:
         # Encode the color as a unique integer
         return (color[0] << 16) + (color[1] << 8) + color[2]
 
-    def process_block(self, palette_name, palette):
-        closest_colors_list = []
-        count1, count2 = 0, 0
-
-        # Retrieve the cache dictionary for the given palette_name
-        palette_cache = self.closest_color_cache[palette_name]
+    @staticmethod
+    def dither_blocks(grid, palette_index, dither, row_offset=0, carry=None):
+        # match_blocks over a (h_blocks, w_blocks, C) grid with dithering, returns (colors, counts, carry). Bayer
+        # offsets every block by its threshold before the match, error diffusion pushes what the match of each block
+        # got wrong onto the blocks after it. row_offset (the grid row of the first row) and carry (the error pushed
+        # past the last row) let a grid be dithered strip by strip with the same result.
+        grid = np.asarray(grid)
+        height, width, channels = grid.shape
+        opaque = grid[:, :, 3] != 0 if channels == 4 else np.ones((height, width), dtype=bool)
+        rgb = grid[:, :, :3].astype(np.float32)
+        if dither in ERROR_KERNELS:
+            indices, count2, carry = ImageManipulator.diffuse_errors(rgb, opaque, palette_index, ERROR_KERNELS[dither],
+                                                                     carry)
+        else:
+            size = int(dither[len("bayer"):])
+            thresholds = ImageManipulator.bayer_matrix(size)
+            thresholds = thresholds[(np.arange(height) + row_offset) % size][:, np.arange(width) % size]
+            rgb += thresholds[:, :, None] * ImageManipulator.dither_spread(palette_index.palette)
+            indices = np.zeros((height, width), dtype=np.intp)
+            indices[opaque], count2 = palette_index.match(np.rint(np.clip(rgb[opaque], 0, 255)).astype(np.uint8))
+
+        closest_colors = grid.copy()
+        closest_colors[opaque, :3] = palette_index.palette[indices[opaque]]
+        if channels == 4:
+            closest_colors[opaque, 3] = 255
+        return closest_colors, (int(opaque.sum()) - count2, count2), carry
 
-        for average_color in self.average_colors:
-            if len(average_color) == 4 and average_color[3] == 0:  # Skip transparent colors
-                closest_colors_list.append(average_color)
-                continue
-            encoded_color = self._encode_color(average_color)
-            cached_closest = palette_cache.get(encoded_color)
-            if cached_closest:
-                closest = cached_closest
-                count1 += 1
+    @staticmethod
+    def diffuse_errors(rgb, opaque, palette_index, kernel, carry=None):
+        # Palette indices of the opaque cells of a (h, w, 3) float grid, with the error of every match spread over
+        # later cells by kernel. A cell only takes error from cells with a smaller x + 2y, so every such diagonal is
+        # matched in one vector step: w + 2h steps instead of one per cell. Returns (indices, refined, carry).
+        height, width, _ = rgb.shape
+        # Two columns of margin on both sides and two rows below, which is as far as the kernels reach. In the
+        # flattened buffer a diagonal is a plain strided slice, and so is every cell its error goes to.
+        stride = width + 4
+        buffer = np.zeros((height + 2, stride, 3), dtype=np.float32)
+        buffer[:height, 2:width + 2] = rgb
+        if carry is not None:
+            buffer[:2] += carry
+        visible = np.zeros((height + 2, stride), dtype=bool)
+        visible[:height, 2:width + 2] = opaque
+        all_visible = bool(opaque.all())
+        indices = np.zeros((height + 2, stride), dtype=np.intp)
+        flat_buffer, flat_visible, flat_indices = buffer.reshape(-1, 3), visible.reshape(-1), indices.reshape(-1)
+        offsets = [(dy * stride + dx, weight) for dx, dy, weight in kernel]
+        palette = palette_index.palette.astype(np.float32)
+        refined = 0
+        for t in range(width + 2 * (height - 1)):
+            first, last = max(0, (t - width + 2) // 2), min(height - 1, t // 2)
+            start = first * stride + t - 2 * first + 2
+            cells = slice(start, start + (last - first) * (stride - 2) + 1, stride - 2)
+            values = np.clip(flat_buffer[cells], 0, 255)
+            if all_visible:
+                matched, count = palette_index.match(np.rint(values).astype(np.uint8))
             else:
-                closest = ImageManipulator.closest_color(average_color, palette)
-                palette_cache[encoded_color] = closest
-                count2 += 1
-            closest_colors_list.append(closest)
+                mask = flat_visible[cells]
+                if not mask.any():
+                    continue
+                matched = np.zeros(len(values), dtype=np.intp)
+                matched[mask], count = palette_index.match(np.rint(values[mask]).astype(np.uint8))
+            flat_indices[cells] = matched
+            refined += count
+            error = values - palette[matched]
+            if not all_visible:
+                error[~mask] = 0
+            for offset, weight in offsets:
+                flat_buffer[cells.start + offset:cells.stop + offset:cells.step] += error * weight
+        return indices[:height, 2:width + 2], refined, buffer[height:]
+
+    @staticmethod
+    def bayer_matrix(size):
+        # size x size ordered dither thresholds, evenly spread over (-0.5, 0.5)
+        matrix = np.zeros((1, 1))
+        while len(matrix) < size:
+            matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+        return (matrix + 0.5) / matrix.size - 0.5
+
+    @staticmethod
+    def dither_spread(palette):
+        # Amplitude of ordered dithering: the median distance from a palette color to its nearest neighbour, so
+        # blocks between two palette colors mix them and blocks close to one keep it
+        palette = np.asarray(palette, dtype=np.float32).reshape(-1, 3)
+        if len(palette) < 2:
+            return 0.0
+        distances = np.sqrt(((palette[:, None, :] - palette[None, :, :]) ** 2).sum(axis=-1))
+        np.fill_diagonal(distances, np.inf)
+        return float(np.median(distances.min(axis=1)))
+
+    @staticmethod
+    def match_blocks(average_colors, palette_index):
+        average_colors = np.asarray(average_colors)
+        closest_colors_list = average_colors.copy()
+        if average_colors.shape[1] == 4:
+            opaque = average_colors[:, 3] != 0  # Skip transparent colors
+            closest_colors_list[opaque, 3] = 255
+        else:
+            opaque = np.ones(len(average_colors), dtype=bool)
+
+        # Map every block in a single LUT lookup, count2 is the number of blocks that needed exact refinement
+        indices, count2 = palette_index.match(average_colors[opaque, :3])
+        closest_colors_list[opaque, :3] = palette_index.palette[indices]
+        count1 = len(indices) - count2
 
         return closest_colors_list, (count1, count2)
 
-    def pixelate(self, image, block_size, palette_name, palette, resize=True):
-        # start = time.time()
-        width, height = image.size
+    @staticmethod
+    def block_averages(image, block_size):
+        # Mean color of every block, reduced in one pass over a (h_blocks, bs, w_blocks, bs, C) view
+        data = np.asarray(image)
+        height, width, channels = data.shape
         h_blocks = (height + block_size - 1) // block_size  # Ensure last block covers remaining pixels
         w_blocks = (width + block_size - 1) // block_size
 
-        block_coords = [(i * block_size, j * block_size,
-                         min((i + 1) * block_size, width),  # Extend block to cover remaining pixels
-                         min((j + 1) * block_size, height))
-                        for j in range(h_blocks) for i in range(w_blocks)]
+        if height % block_size or width % block_size:
+            padded = np.zeros((h_blocks * block_size, w_blocks * block_size, channels), dtype=data.dtype)
+            padded[:height, :width] = data
+            data = padded
+        sums = data.reshape(h_blocks, block_size, w_blocks, block_size, channels).sum(axis=(1, 3), dtype=np.int64)
 
-        if self.last_block_size == block_size:
-            self.average_colors = []
-            for coords in block_coords:
-                region = np.array(image.crop(coords))
-                average_color = tuple(np.mean(region, axis=(0, 1)).astype(int))
-                self.average_colors.append(average_color)
+        # Edge blocks are ragged, so divide by the number of pixels that actually fall inside each block
+        block_heights = np.minimum(block_size, height - np.arange(h_blocks) * block_size)
+        block_widths = np.minimum(block_size, width - np.arange(w_blocks) * block_size)
+        counts = np.outer(block_heights, block_widths)[:, :, None]
+        return sums // counts
 
-        closest_colors, (count1, count2) = self.process_block(palette_name, palette)
+    @staticmethod
+    def nearest_indices(source_length, target_length):
+        # Source index PIL's Image.NEAREST resize samples for every target position along one axis
+        positions = Image.fromarray(np.arange(source_length, dtype=np.int32)[None, :])
+        return np.asarray(positions.resize((target_length, 1), resample=Image.NEAREST))[0]
 
-        for closest, coords in zip(closest_colors, block_coords):
-            image.paste(closest, coords)
+    @staticmethod
+    def grid_samples(size, block_size, resize=True):
+        # Grid row of every output row and grid column of every output column of a pixelated image
+        width, height = size
+        if resize:
+            rows = ImageManipulator.nearest_indices(height, int(height * (1 / block_size)))
+            columns = ImageManipulator.nearest_indices(width, int(width * (1 / block_size)))
+        else:
+            rows, columns = np.arange(height), np.arange(width)
+        return rows // block_size, columns // block_size
 
-        print(f'{count1}/{count1 + count2}')
+    @staticmethod
+    def grid_weights(grid, samples):
+        # Number of output pixels every grid cell turns into
+        rows, columns = samples
+        return np.outer(np.bincount(rows, minlength=grid.height), np.bincount(columns, minlength=grid.width))
 
-        if resize:
-            resize_factor = 1 / block_size
-            new_width = int(width * resize_factor)
-            new_height = int(height * resize_factor)
-            image = image.resize((new_width, new_height), resample=Image.NEAREST)
-        self.last_block_size = block_size
-        # print(abs(start - time.time()))
+    @staticmethod
+    def expand_grid(grid, samples):
+        # Copies every output pixel from its grid cell, RGBA cells are gathered as whole uint32 words
+        rows, columns = samples
+        data = np.ascontiguousarray(np.asarray(grid))
+        if data.shape[2] == 4:
+            words = np.ascontiguousarray(data.view(np.uint32)[:, :, 0][rows][:, columns])
+            return Image.fromarray(words.view(np.uint8).reshape(len(rows), len(columns), 4))
+        return Image.fromarray(data[rows][:, columns])
+
+    @staticmethod
+    def expand_indexed(grid, samples):
+        # expand_grid as a "P" image, with one palette entry per color of the block grid and tRNS for the transparent
+        # ones. Adjustments can leave more than 256 colors; fully transparent blocks then share one entry, and if that
+        # is still too many None is returned.
+        data = np.asarray(grid)
+        if data.shape[2] == 3:
+            data = np.dstack([data, np.full(data.shape[:2], 255, dtype=np.uint8)])
+        packed = ImageManipulator.pack_rgba(data)
+        keys, inverse = np.unique(packed, return_inverse=True)
+        if len(keys) > 256:
+            packed[data[:, :, 3] == 0] = 0
+            keys, inverse = np.unique(packed, return_inverse=True)
+            if len(keys) > 256:
+                return None
+        rows, columns = samples
+        indices = inverse.reshape(packed.shape).astype(np.uint8)[rows][:, columns]
+        colors = keys.astype(">u4").view(np.uint8).reshape(-1, 4)
+        image = Image.frombytes("P", (len(columns), len(rows)), np.ascontiguousarray(indices).tobytes())
+        return ImageManipulator.with_palette(image, np.ascontiguousarray(colors[:, :3]), colors[:, 3])
+
+    def match_grid(self, image, block_size, palette_name, palette, recorder=NULL_RECORDER, metric="rgb",
+                   dither="none"):
+        # The pixelated image before it is expanded: one pixel of the closest palette color per block
+        with recorder.stage("block_average"):
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA")
+            grid = self.block_averages(image, block_size)
+        h_blocks, w_blocks, channels = grid.shape
+        recorder.array("grid", grid)
+
+        # The cache is keyed by the palette contents, palette_name is only kept for callers
+        with recorder.stage("palette_match"):
+            palette_index = self.closest_color_cache.get(palette, metric)
+            if dither == "none":
+                closest_colors, (count1, count2) = self.match_blocks(grid.reshape(-1, channels), palette_index)
+            else:
+                closest_colors, (count1, count2), _ = self.dither_blocks(grid, palette_index, dither)
+        self.closest_color_cache.record_matches(count1, count2)
+        recorder.count("lut_hits", count1)
+        recorder.count("lut_refined", count2)
+        return Image.fromarray(closest_colors.reshape(h_blocks, w_blocks, channels).astype(np.uint8))
+
+    def pixelate(self, image, block_size, palette_name, palette, resize=True, saturation=0, brightness=0,
+                 contrast=0, metric="rgb", dither="none"):
+        # Adjustments run on the block grid, before it is expanded to the output size
+        samples = self.grid_samples(image.size, block_size, resize)
+        grid = self.match_grid(image, block_size, palette_name, palette, metric=metric, dither=dither)
+        grid = self.adjust_grid(grid, saturation, brightness, contrast, self.grid_weights(grid, samples))
+        return self.expand_grid(grid, samples)
+
+    def pixelate_image(self, image_path, block_size, saturation, remove_background, palette_name, palette,
+                       brightness=0, contrast=0, memory_budget=None, canceled=None, background_mode="most_common",
+                       recorder=NULL_RECORDER, output_format="rgba", compress_level=None, optimize=False,
+                       metric="rgb", dither="none"):
+        # compress_level (0 fastest to 9 smallest, zlib's default when None) and optimize go to the PNG encoder,
+        # metric is the PaletteIndex distance palette colors are matched with, dither one of DITHER_MODES
+        output_path = self.pixelated_path(image_path)
+        if self.should_tile(image_path, memory_budget):
+            return self.pixelate_tiled(image_path, output_path, block_size, saturation, remove_background, palette,
+                                       brightness, contrast, memory_budget, canceled, background_mode, recorder,
+                                       compress_level, metric, dither)
+
+        pixelated_image = self.pixelate_stages(StageCache.file_key(image_path),
+                                               lambda: self.load_source(image_path, recorder), block_size,
+                                               palette_name, palette, saturation, brightness, contrast,
+                                               remove_background, background_mode, recorder=recorder,
+                                               indexed=output_format == "indexed", metric=metric, dither=dither)
+        return self.save_output(pixelated_image, output_path, recorder, compress_level, optimize)
+
+    @staticmethod
+    def pixelated_path(image_path):
+        output_dir = os.path.join(os.path.dirname(image_path), 'pixelated_images')
+        os.makedirs(output_dir, exist_ok=True)
+        return os.path.join(output_dir, os.path.basename(image_path))
+
+    @staticmethod
+    def load_source(image_path, recorder=NULL_RECORDER):
+        recorder.count("bytes_read", os.path.getsize(image_path))
+        with recorder.stage("decode"):
+            return ImageManipulator.open_image(image_path)
+
+    @staticmethod
+    def save_output(image, output_path, recorder=NULL_RECORDER, compress_level=None, optimize=False):
+        options = {} if compress_level is None else {'compress_level': compress_level}
+        with recorder.stage("encode"):
+            image.save(output_path, optimize=optimize, **options)
+        recorder.count("bytes_written", os.path.getsize(output_path))
+        return output_path
+
+    def pixelate_tiled(self, image_path, output_path, block_size, saturation, remove_background, palette, brightness=0,
+                       contrast=0, memory_budget=None, canceled=None, background_mode="most_common",
+                       recorder=NULL_RECORDER, compress_level=None, metric="rgb", dither="none"):
+        # Streams the file through TiledProcessor, which reads, computes and writes strip by strip. The output is
+        # always RGBA, the colors of the whole image are not known until the last strip.
+        palette_index = self.closest_color_cache.get(palette, metric)
+        with recorder.stage("tiled"):
+            self.tiled(memory_budget, canceled).pixelate(image_path, output_path, block_size, palette_index,
+                                                         remove_background, True, saturation, brightness, contrast,
+                                                         background_mode, compress_level, dither)
+        recorder.count("bytes_read", os.path.getsize(image_path))
+        recorder.count("bytes_written", os.path.getsize(output_path))
+        return output_path
+
+    def pixelate_stages(self, source_key, load, block_size, palette_name, palette, saturation=0, brightness=0,
+                        contrast=0, remove_background=0, background_mode="most_common", resize=True,
+                        recorder=NULL_RECORDER, indexed=False, metric="rgb", dither="none"):
+        # load -> background -> block grid -> adjustments -> expand through the stage cache, source_key
+        # identifies what load() returns. Stages never modify their input, cached images are shared. indexed
+        # expands to a "P" image when the result has at most 256 colors.
+        def stage(name, params, upstream, compute, timer=None):
+            # Times compute under timer and counts whether the stage cache had it
+            computed = []
+
+            def run():
+                computed.append(True)
+                with recorder.stage(timer) if timer else nullcontext():
+                    return compute()
+
+            key, value = self.stage_cache.stage(name, params, upstream, run)
+            recorder.count("stage_cache_misses" if computed else "stage_cache_hits")
+            return key, value
+
+        # load() times its own decoding, a prefetched or proxy source costs nothing here
+        key, image = stage("source", source_key, None, load)
+        recorder.array("source", image)
+        if remove_background:
+            key, image = stage("background", background_mode, key,
+                               lambda: ImageManipulator.remove_img_background(image, background_mode), "background")
+        samples = self.grid_samples(image.size, block_size, resize)
+        key, grid = stage("grid", (block_size, self.closest_color_cache.key(palette, metric), dither), key,
+                          lambda: self.match_grid(image, block_size, palette_name, palette, recorder, metric, dither))
+        key, grid = stage("adjust", (saturation, brightness, contrast, resize), key,
+                          lambda: self.adjust_grid(grid, saturation, brightness, contrast,
+                                                   self.grid_weights(grid, samples)), "adjust")
+        def expand():
+            image = self.expand_indexed(grid, samples) if indexed else None
+            return image if image is not None else self.expand_grid(grid, samples)
+
+        key, image = stage("expand", (resize, indexed), key, expand, "expand")
+        recorder.array("output", image)
         return image
+
+    @staticmethod
+    def open_image(path):
+        # Decoded right away, so the file is closed and the image can be cached
+        image = Image.open(path)
+        image.load()
+        return image
+
+    def pixelate_images(self, files, settings, palette, progress=None, canceled=None, memory_budget=None,
+                        recorder=None):
+        # settings is the dict PixelateWindow.export_settings writes, palette the colors of settings['palette'].
+        # With a recorder every file gets its own record and result.metrics holds the totals.
+        output_directory = os.path.join(os.path.dirname(files[0]), 'pixelated_images') if files else ""
+        result = OperationResult("pixelate", files, output_directory, "Pixelated images saved successfully.")
+        block_size, saturation = settings['block_size'], settings['saturation']
+        remove_background = settings['background']
+        brightness, contrast = settings.get('brightness', 0), settings.get('contrast', 0)
+        background_mode = settings.get('background_mode', "most_common")
+        output_format = settings.get('output_format', "rgba")
+        compress_level, optimize = settings.get('compress_level'), settings.get('optimize', False)
+        metric, dither = settings.get('metric', "rgb"), settings.get('dither', "none")
+
+        # Files go through a BatchPipeline: the next files are decoded and the previous ones encoded while one is
+        # being pixelated. Files above their share of the memory budget are streamed as a whole in the compute stage.
+        pipeline = BatchPipeline()
+        memory_budget = pipeline.share(memory_budget or DEFAULT_MEMORY_BUDGET)
+
+        def decode(item):
+            file, file_recorder = item
+            if self.should_tile(file, memory_budget):
+                return None
+            source_key = StageCache.file_key(file)
+            # A source the stage cache still holds, e.g. when exporting again after a tweak, is not decoded again
+            if self.stage_cache.contains("source", source_key, None):
+                return source_key, None
+            return source_key, self.load_source(file, file_recorder)
+
+        def compute(item, decoded):
+            file, file_recorder = item
+            if decoded is None:
+                return None, self.pixelate_tiled(file, self.pixelated_path(file), block_size, saturation,
+                                                 remove_background, palette, brightness, contrast, memory_budget,
+                                                 canceled, background_mode, file_recorder, compress_level, metric,
+                                                 dither)
+            source_key, image = decoded
+            load = (lambda: image) if image is not None else (lambda: self.load_source(file, file_recorder))
+            return self.pixelate_stages(source_key, load, block_size, settings['palette'], palette, saturation,
+                                        brightness, contrast, remove_background, background_mode,
+                                        recorder=file_recorder, indexed=output_format == "indexed",
+                                        metric=metric, dither=dither), None
+
+        def encode(item, computed):
+            file, file_recorder = item
+            image, output_path = computed
+            if image is None:
+                return output_path
+            return self.save_output(image, self.pixelated_path(file), file_recorder, compress_level, optimize)
+
+        items = [(file, Recorder() if recorder is not None else NULL_RECORDER) for file in files]
+        for i, ((file, file_recorder), output, error) in enumerate(
+                pipeline.run(items, decode, compute, encode, canceled)):
+            if isinstance(error, OperationCanceled):
+                result.canceled = True
+                break
+            if error is None:
+                result.outputs.append(output)
+            else:
+                result.add_failure(file, error)
+            if recorder is not None:
+                recorder.add_record(file, file_recorder.snapshot(), "ok" if error is None else "failed")
+            if progress:
+                progress(i + 1, len(files))
+        # Files that were never started because of a cancel request are not yielded at all
+        if canceled and canceled() and len(result.outputs) + len(result.failed) < len(files):
+            result.canceled = True
+        if recorder is not None:
+            result.metrics = recorder.snapshot()
+        return result
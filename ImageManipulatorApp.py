@@ -1,10 +1,9 @@
 from tkinter.colorchooser import askcolor
 from tkinter import filedialog, messagebox
-from PIL import Image
 import os
 import tkinter as tk
 from CustomWidgets import ToolTip, CustomDialog
-from Functions import BG_COLOR, export_message
+from Functions import BG_COLOR, show_result
 from ImageManipulator import ImageManipulator
 from PixelateWindow import PixelateWindow
 
@@ -68,12 +67,14 @@ class ImageManipulatorApp:
             directory = os.path.dirname(files[0])
 
             # Use custom dialog to get resize percentage
-            dialog = CustomDialog(self.root, "Input", "Enter Resize Percentage (%):")
+            dialog = CustomDialog(self.root, "Input", "Enter Resize Percentage (%), several separated by commas:")
             resize_percent_str = dialog.show()
 
             if resize_percent_str:
-                resize_percent = float(resize_percent_str) / 100.0
-                ImageManipulator.resize_images(files, directory, resize_percent)
+                # Several percentages are all made from one decode of every image
+                factors = [float(percent) / 100.0 for percent in resize_percent_str.split(",")]
+                resize_percent = factors[0] if len(factors) == 1 else factors
+                show_result(ImageManipulator.resize_images(files, directory, resize_percent))
             else:
                 messagebox.showerror("Error", "Please enter a resize percentage.")
 
@@ -81,7 +82,7 @@ class ImageManipulatorApp:
         files = filedialog.askopenfilenames(filetypes=[("PNG files", "*.png")])
         if files:
             directory = os.path.dirname(files[0])
-            ImageManipulator.create_spritesheet(files, directory)
+            show_result(ImageManipulator.create_spritesheet(files, directory))
 
     def select_colors(self):
         # Set default colors
@@ -99,7 +100,7 @@ class ImageManipulatorApp:
                 if files:
                     # Get the directory of the first selected file
                     directory = os.path.dirname(files[0])
-                    ImageManipulator.replace_color(files, directory, target_color, new_color)
+                    show_result(ImageManipulator.replace_color(files, directory, target_color, new_color))
 
     def pixelate_images_option(self):
         files = filedialog.askopenfilenames(filetypes=[("PNG files", "*.png")])
@@ -119,15 +120,4 @@ class ImageManipulatorApp:
                 self.remove_color(files, directory, target_color)
 
     def remove_color(self, files, output_directory, target_color):
-        removed_directory = output_directory + "/removed_images"
-        os.makedirs(removed_directory, exist_ok=True)
-
-        for file in files:
-            img = Image.open(file)
-            img = img.convert("RGBA")
-            img = ImageManipulator.remove_color(img, target_color[:3])
-            file_name = os.path.basename(file)
-            img.save(f"{removed_directory}/{file_name}")
-
-        export_message(files, message="Color removed from images and saved successfully.")
-
+        show_result(ImageManipulator.remove_color_images(files, output_directory, target_color))
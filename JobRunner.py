@@ -0,0 +1,173 @@
+import json
+import os
+from BatchPipeline import BatchPipeline
+from BuildManifest import run_incremental
+from Functions import PALETTES, get_palette
+from ImageManipulator import BACKGROUND_MODES, DITHER_MODES, OUTPUT_FORMATS, ImageManipulator, OperationResult
+from PaletteIndex import METRICS
+from StageCache import StageCache
+
+# A job file chains operations over a set of images:
+#   {"steps": [{"operation": "resize", "percent": 200},
+#              {"operation": "replace", "map": [["#7F7F7F", "#000099"], ["255,0,0", [0, 0, 255]]]},
+#              {"operation": "remove", "color": "127,127,127"},
+#              {"operation": "pixelate", "block_size": 6}],
+#    "output_format": "indexed", "compress_level": 9}
+# It extends the settings JSON of the Pixelate window: top-level settings are the defaults of every pixelate step,
+# and a settings file without "steps" is a job with a single pixelate step.
+OPERATIONS = ("resize", "replace", "remove", "pixelate")
+# Defaults of the settings JSON, for job files and the command line alike. Background removal is on like the checkbox
+# of the Pixelate window.
+DEFAULT_SETTINGS = {'block_size': 8, 'saturation': 0, 'brightness': 0, 'contrast': 0, 'palette': PALETTES[0]["name"],
+                    'background': 1, 'background_mode': BACKGROUND_MODES[0], 'output_format': OUTPUT_FORMATS[0],
+                    'compress_level': None, 'optimize': False, 'metric': METRICS[0], 'dither': DITHER_MODES[0]}
+# Settings a pixelate step can override, the others apply to the encode of the whole job
+STEP_SETTINGS = ('block_size', 'saturation', 'brightness', 'contrast', 'palette', 'background', 'background_mode',
+                 'metric', 'dither')
+
+
+def parse_color(value):
+    # [R, G, B], "R,G,B" or "#RRGGBB"
+    try:
+        if isinstance(value, str):
+            if value.startswith("#"):
+                color = tuple(int(value[i:i + 2], 16) for i in (1, 3, 5))
+            else:
+                color = tuple(int(part) for part in value.split(","))
+        else:
+            color = tuple(int(part) for part in value)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid color: {value!r}")
+    if len(color) != 3 or not all(0 <= c <= 255 for c in color):
+        raise ValueError(f"invalid color: {value!r}")
+    return color
+
+
+def parse_integer(settings, key, minimum=None, maximum=None):
+    # JSON numbers are checked up front, a float block size or a string level would only fail in the middle of a run
+    value = settings[key]
+    if isinstance(value, bool) or not isinstance(value, int) or \
+            (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        bounds = f" from {minimum}" if minimum is not None else ""
+        bounds += f" to {maximum}" if maximum is not None else ""
+        raise ValueError(f"{key} must be a whole number{bounds}, not {value!r}")
+    return value
+
+
+def validate_settings(settings):
+    # Raises ValueError on the first invalid pixelate setting
+    parse_integer(settings, 'block_size', 1)
+    for key in ('saturation', 'brightness', 'contrast'):
+        parse_integer(settings, key)
+    parse_integer(settings, 'background', 0, 1)
+    if get_palette(settings['palette']) is None:
+        raise ValueError(f"unknown palette: {settings['palette']!r}")
+    if settings['background_mode'] not in BACKGROUND_MODES:
+        raise ValueError(f"unknown background mode: {settings['background_mode']!r}")
+    if settings['metric'] not in METRICS:
+        raise ValueError(f"unknown metric: {settings['metric']!r}")
+    if settings['dither'] not in DITHER_MODES:
+        raise ValueError(f"unknown dither mode: {settings['dither']!r}")
+    if settings['output_format'] not in OUTPUT_FORMATS:
+        raise ValueError(f"unknown output format: {settings['output_format']!r}")
+    if settings['compress_level'] is not None:
+        parse_integer(settings, 'compress_level', 0, 9)
+    return settings
+
+
+def load_job(path):
+    with open(path) as file:
+        return parse_job(json.load(file))
+
+
+def parse_job(job):
+    # Validates a job dict and returns it with every step complete, so running it never fails half way on a typo
+    if not isinstance(job, dict):
+        raise ValueError(f"a job is a JSON object, not {type(job).__name__}")
+    steps = job.get('steps', [{'operation': "pixelate"}])
+    if not isinstance(steps, list):
+        raise ValueError(f"steps is a list of step objects, not {type(steps).__name__}")
+    if not steps:
+        raise ValueError("the job has no steps")
+    job_settings = dict(DEFAULT_SETTINGS, **{key: job[key] for key in DEFAULT_SETTINGS if key in job})
+    parsed = []
+    for number, step in enumerate(steps, 1):
+        if not isinstance(step, dict):
+            raise ValueError(f"step {number} is not an object: {step!r}")
+        operation = step.get('operation')
+        if operation not in OPERATIONS:
+            raise ValueError(f"unknown operation {operation!r}, expected one of {', '.join(OPERATIONS)}")
+        if operation == "resize":
+            percent = step.get('percent')
+            if isinstance(percent, bool) or not isinstance(percent, (int, float)) or percent <= 0:
+                raise ValueError(f"resize needs a positive percent, not {percent!r}")
+            parsed.append({'operation': operation, 'percent': float(percent)})
+        elif operation == "replace":
+            entries = step.get('map', [])
+            if not isinstance(entries, list) or not entries:
+                raise ValueError("replace needs a non-empty map of [source, target] colors")
+            for entry in entries:
+                if not isinstance(entry, list) or len(entry) != 2:
+                    raise ValueError(f"replace map entries are [source, target] pairs, not {entry!r}")
+            pairs = [(parse_color(source), parse_color(target)) for source, target in entries]
+            parsed.append({'operation': operation, 'map': pairs})
+        elif operation == "remove":
+            parsed.append({'operation': operation, 'color': parse_color(step.get('color'))})
+        else:
+            settings = validate_settings(dict(job_settings, **{key: step[key] for key in STEP_SETTINGS if key in step}))
+            parsed.append(dict({key: settings[key] for key in STEP_SETTINGS}, operation=operation))
+    validate_settings(job_settings)
+    return {'steps': parsed, 'output_format': job_settings['output_format'],
+            'compress_level': job_settings['compress_level'], 'optimize': bool(job_settings['optimize'])}
+
+
+class JobRunner:
+    # Runs a parsed job over files: every image is decoded once, goes through all the steps in memory and is encoded
+    # once into job_images, with decoding and encoding overlapped by a BatchPipeline.
+    def __init__(self, palette_cache=None):
+        # Intermediate images of a chain are never reused, so the stages are not cached
+        self.pixelization = ImageManipulator(palette_cache, StageCache(max_entries=0))
+
+    def apply(self, image, job):
+        for step in job['steps']:
+            image = self.apply_step(image, step, job['output_format'] == "indexed")
+        return image
+
+    def apply_step(self, image, step, indexed=False):
+        operation = step['operation']
+        if operation == "resize":
+            return ImageManipulator.scale_nearest(image, step['percent'] / 100)
+        if operation == "replace":
+            return ImageManipulator.map_colors(image, ImageManipulator.color_map_table(dict(step['map'])))
+        if operation == "remove":
+            return ImageManipulator.remove_color(image, step['color'])
+        return self.pixelization.pixelate_stages(None, lambda: image, step['block_size'], step['palette'],
+                                                 get_palette(step['palette']), step['saturation'],
+                                                 step['brightness'], step['contrast'], step['background'],
+                                                 step['background_mode'], indexed=indexed, metric=step['metric'],
+                                                 dither=step['dither'])
+
+    def run(self, job, files, output_directory, incremental=False):
+        # incremental skips files whose content and job match the manifest of job_images
+        job_directory = os.path.join(output_directory, "job_images")
+        os.makedirs(job_directory, exist_ok=True)
+
+        def output_path(file):
+            return os.path.join(job_directory, os.path.basename(file))
+
+        if incremental:
+            return run_incremental(files, output_path, job, lambda changed: self.run(job, changed, output_directory))
+
+        result = OperationResult("job", files, job_directory, "Job finished successfully.")
+
+        def encode(file, image):
+            return ImageManipulator.save_output(image, output_path(file), compress_level=job['compress_level'],
+                                                optimize=job['optimize'])
+
+        for file, output, error in BatchPipeline().run(files, ImageManipulator.open_image,
+                                                       lambda file, image: self.apply(image, job), encode):
+            if error is None:
+                result.outputs.append(output)
+            else:
+                result.add_failure(file, error)
+        return result
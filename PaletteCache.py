@@ -0,0 +1,161 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from PaletteIndex import PaletteIndex
+
+
+class PaletteCache:
+    # Palette indexes keyed by a hash of the palette contents and the distance metric, so renaming a palette keeps it
+    # warm and editing its colors never returns stale matches. Bounded LRU in memory, optionally persisted under
+    # cache_dir as .npy files that are memory-mapped back in by later runs. Safe to share between threads, a palette
+    # requested by several threads at once is only built once. The exact tables of the other metrics go to disk once
+    # complete() has filled them.
+
+    def __init__(self, cache_dir=None, max_entries=16, max_disk_entries=64, bits=6):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.bits = bits
+        self.indexes = OrderedDict()
+        self.lock = threading.RLock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+            self.color_hits = 0
+            self.color_misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'color_hits': self.color_hits, 'color_misses': self.color_misses, 'entries': len(self.indexes)}
+
+    def record_matches(self, color_hits, color_misses):
+        # Colors resolved straight from a LUT cell vs colors that needed exact refinement
+        with self.lock:
+            self.color_hits += color_hits
+            self.color_misses += color_misses
+
+    def key(self, palette, metric="rgb"):
+        palette = np.array(palette, dtype=np.uint8).reshape(-1, 3)
+        digest = hashlib.sha1(f"{metric}:{self.bits}:".encode() + palette.tobytes())
+        return digest.hexdigest()
+
+    def get(self, palette, metric="rgb"):
+        key = self.key(palette, metric)
+        with self.lock:
+            palette_index = self.indexes.get(key)
+            if palette_index is not None:
+                self.indexes.move_to_end(key)
+                self.hits += 1
+                return palette_index
+
+            palette_index = self._load(key, palette) if metric == "rgb" else self._load_table(key, palette, metric)
+            if palette_index is not None:
+                self.disk_hits += 1
+            else:
+                palette_index = PaletteIndex(palette, bits=self.bits, metric=metric)
+                self.misses += 1
+                if metric == "rgb":
+                    self._save(key, palette_index)
+
+            self.put(palette, palette_index)
+            return palette_index
+
+    def put(self, palette, palette_index):
+        with self.lock:
+            self.indexes[self.key(palette, palette_index.metric)] = palette_index
+            while len(self.indexes) > self.max_entries:
+                self.indexes.popitem(last=False)
+
+    def complete(self, palette, metric="rgb", map=map):
+        # Returns the index with its exact table filled, for batches about to match many images. Filling is the slow
+        # part of a perceptual metric, so the filled table is saved and later runs load it instead. The fill runs
+        # outside the lock, matches from other threads keep using the lazy index until the filled one is swapped in.
+        palette_index = self.get(palette, metric)
+        if metric == "rgb" or palette_index.complete:
+            return palette_index
+        filled = PaletteIndex(palette, bits=self.bits, metric=metric)
+        filled.fill_table(map=map)
+        self._save_table(self.key(palette, metric), filled.table)
+        self.put(palette, filled)
+        return filled
+
+    def clear(self):
+        with self.lock:
+            self.indexes.clear()
+
+    def _paths(self, key):
+        return (os.path.join(self.cache_dir, f"{key}.lut.npy"),
+                os.path.join(self.cache_dir, f"{key}.candidates.npy"))
+
+    def _load(self, key, palette):
+        if not self.cache_dir:
+            return None
+        lut_path, candidates_path = self._paths(key)
+        try:
+            lut = np.load(lut_path, mmap_mode="r")
+            candidates = np.load(candidates_path, mmap_mode="r")
+            # Touch the files so disk eviction sees them as recently used
+            os.utime(lut_path)
+            os.utime(candidates_path)
+        except (OSError, ValueError):
+            return None
+        return PaletteIndex(palette, bits=self.bits, lut=lut, candidates=candidates)
+
+    def _load_table(self, key, palette, metric):
+        if not self.cache_dir:
+            return None
+        table_path = self._table_path(key)
+        try:
+            table = np.load(table_path, mmap_mode="r")
+            os.utime(table_path)
+        except (OSError, ValueError):
+            return None
+        if table.shape != (1 << 24,):
+            return None
+        return PaletteIndex(palette, bits=self.bits, metric=metric, table=table)
+
+    def _table_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.table.npy")
+
+    def _save(self, key, palette_index):
+        if self.cache_dir:
+            self._write(zip(self._paths(key), (palette_index.lut, palette_index.candidates)))
+
+    def _save_table(self, key, table):
+        if self.cache_dir:
+            self._write([(self._table_path(key), table)])
+
+    def _write(self, files):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for path, array in files:
+                # Write next to the final name and swap it in, so a concurrent reader never sees a partial file
+                temp_path = f"{path}.{os.getpid()}.tmp"
+                with open(temp_path, "wb") as file:
+                    np.save(file, array)
+                os.replace(temp_path, path)
+            self._evict_disk()
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        # An rgb index is its .lut.npy and .candidates.npy, a perceptual one its .table.npy
+        entries = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                   if name.endswith((".lut.npy", ".table.npy"))]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for entry_path in entries[self.max_disk_entries:]:
+            paths = [entry_path]
+            if entry_path.endswith(".lut.npy"):
+                paths.append(entry_path[:-len(".lut.npy")] + ".candidates.npy")
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
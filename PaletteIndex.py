@@ -0,0 +1,188 @@
+from itertools import repeat
+import numpy as np
+
+# Distance metrics: Euclidean RGB, "redmean" weighted RGB, Euclidean CIELAB (Delta E 1976) and CIEDE2000
+METRICS = ("rgb", "weighted_rgb", "cie76", "ciede2000")
+PERCEPTUAL_METRICS = ("cie76", "ciede2000")
+
+# sRGB value -> linear light, and linear RGB -> XYZ relative to the D65 white point
+_LINEAR = np.where(np.arange(256) / 255 <= 0.04045, np.arange(256) / 255 / 12.92,
+                   ((np.arange(256) / 255 + 0.055) / 1.055) ** 2.4)
+_RGB_TO_XYZ = np.array([[0.4124564, 0.3575761, 0.1804375],
+                        [0.2126729, 0.7151522, 0.0721750],
+                        [0.0193339, 0.1191920, 0.9503041]]) / np.array([0.95047, 1.0, 1.08883])[:, None]
+
+
+def rgb_to_lab(colors):
+    # (..., 3) uint8 sRGB -> (..., 3) float CIELAB
+    xyz = _LINEAR[np.asarray(colors, dtype=np.intp)] @ _RGB_TO_XYZ.T
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+def ciede2000(lab1, lab2):
+    # Delta E 2000 between broadcast (..., 3) CIELAB arrays, as formulated by Sharma, Wu and Dalal with kL = kC = kH = 1
+    L1, a1, b1 = np.moveaxis(lab1, -1, 0)
+    L2, a2, b2 = np.moveaxis(lab2, -1, 0)
+    c7 = ((np.hypot(a1, b1) + np.hypot(a2, b2)) / 2) ** 7
+    g = 0.5 * (1 - np.sqrt(c7 / (c7 + 25.0 ** 7)))
+    a1, a2 = a1 * (1 + g), a2 * (1 + g)
+    c1, c2 = np.hypot(a1, b1), np.hypot(a2, b2)
+    h1, h2 = np.degrees(np.arctan2(b1, a1)) % 360, np.degrees(np.arctan2(b2, a2)) % 360
+    chroma = c1 * c2 != 0
+
+    dh = h2 - h1
+    dh = np.where(dh > 180, dh - 360, np.where(dh < -180, dh + 360, dh)) * chroma
+    dL, dC = L2 - L1, c2 - c1
+    dH = 2 * np.sqrt(c1 * c2) * np.sin(np.radians(dh) / 2)
+
+    L_mean, c_mean, h_sum = (L1 + L2) / 2, (c1 + c2) / 2, h1 + h2
+    h_mean = np.where(np.abs(h1 - h2) > 180, np.where(h_sum < 360, h_sum + 360, h_sum - 360), h_sum) / 2
+    h_mean = np.where(chroma, h_mean, h_sum)
+    t = (1 - 0.17 * np.cos(np.radians(h_mean - 30)) + 0.24 * np.cos(np.radians(2 * h_mean)) +
+         0.32 * np.cos(np.radians(3 * h_mean + 6)) - 0.20 * np.cos(np.radians(4 * h_mean - 63)))
+    c7 = c_mean ** 7
+    rotation = -2 * np.sqrt(c7 / (c7 + 25.0 ** 7)) * np.sin(np.radians(60 * np.exp(-((h_mean - 275) / 25) ** 2)))
+    sL = 1 + 0.015 * (L_mean - 50) ** 2 / np.sqrt(20 + (L_mean - 50) ** 2)
+    sC = 1 + 0.045 * c_mean
+    sH = 1 + 0.015 * c_mean * t
+    return np.sqrt((dL / sL) ** 2 + (dC / sC) ** 2 + (dH / sH) ** 2 + rotation * (dC / sC) * (dH / sH))
+
+
+class PaletteIndex:
+    # Maps whole arrays of RGB colors to their nearest palette entry. For the "rgb" metric a quantized RGB ->
+    # palette-index LUT resolves every cell that only one palette color can win, colors in cells that straddle a
+    # boundary are refined exactly against the short list of palette colors that can win somewhere in that cell.
+    # Other metrics have no such cell bounds, so they use an exact table over all 2^24 colors. fill_table measures
+    # every color once up front, which only large parallel batches do before their first image; everywhere else the
+    # table fills in as colors are seen.
+    CHUNK_SIZE = 65536
+
+    def __init__(self, palette, bits=6, lut=None, candidates=None, metric="rgb", table=None):
+        if metric not in METRICS:
+            raise ValueError(f"unknown metric {metric!r}, expected one of {', '.join(METRICS)}")
+        self.palette = np.array(palette, dtype=np.uint8).reshape(-1, 3)
+        self.bits = bits
+        self.shift = 8 - bits
+        self.metric = metric
+        self.lut, self.candidates, self.table = None, None, table
+        # Only filled tables are passed in, from disk or from the process that filled them
+        self.complete = table is not None
+        if metric == "rgb":
+            if lut is None or candidates is None:
+                lut, candidates = self._build_lut()
+            self.lut, self.candidates = lut, candidates
+        else:
+            # The palette is converted once, the table is allocated on the first match
+            self.reference = rgb_to_lab(self.palette) if metric in PERCEPTUAL_METRICS else self.palette.astype(np.int32)
+
+    def _build_lut(self):
+        cell_size = 1 << self.shift
+        low = np.arange(1 << self.bits, dtype=np.int32)[:, None] * cell_size
+        high = low + cell_size - 1
+        palette = self.palette.astype(np.int32)
+
+        # Squared distance from every cell to every palette color, per channel: closest and farthest point of the cell
+        nearest, farthest = [], []
+        for channel in range(3):
+            color = palette[:, channel]
+            nearest.append(np.maximum(np.maximum(low - color, color - high), 0) ** 2)
+            farthest.append(np.maximum(np.abs(low - color), np.abs(high - color)) ** 2)
+        nearest = nearest[0][:, None, None] + nearest[1][None, :, None] + nearest[2][None, None, :]
+        farthest = farthest[0][:, None, None] + farthest[1][None, :, None] + farthest[2][None, None, :]
+
+        # A color can only be the closest somewhere in the cell if it gets nearer than the best worst case
+        candidates = nearest <= farthest.min(axis=-1, keepdims=True)
+        counts = candidates.sum(axis=-1)
+        lut = np.where(counts == 1, candidates.argmax(axis=-1), -1).astype(np.int16)
+
+        # Candidates of every cell in palette order, padded with the first one so that ties still favor the lowest index
+        order = np.argsort(~candidates, axis=-1, kind="stable")[..., :counts.max()]
+        padding = np.arange(order.shape[-1]) >= counts[..., None]
+        order[padding] = np.broadcast_to(order[..., :1], order.shape)[padding]
+        return lut, order.astype(np.int16)
+
+    def distances(self, colors):
+        # (N, palette size) distances of (N, 3) colors under the metric, squared where that keeps the order
+        if self.metric == "rgb":
+            return ((colors[:, None, :].astype(np.int32) - self.palette.astype(np.int32)[None, :, :]) ** 2).sum(axis=-1)
+        if self.metric == "weighted_rgb":
+            colors = colors.astype(np.int32)
+            red_mean = (colors[:, None, 0] + self.reference[None, :, 0]) // 2
+            delta = (colors[:, None, :] - self.reference[None, :, :]) ** 2
+            return ((512 + red_mean) * delta[..., 0] >> 8) + 4 * delta[..., 1] + ((767 - red_mean) * delta[..., 2] >> 8)
+        lab = rgb_to_lab(colors)
+        if self.metric == "cie76":
+            return ((lab[:, None, :] - self.reference[None, :, :]) ** 2).sum(axis=-1)
+        return ciede2000(lab[:, None, :], self.reference[None, :, :])
+
+    def nearest(self, colors):
+        # Exact match under the metric, the first palette entry wins ties like np.argmin over the distances
+        colors = np.asarray(colors, dtype=np.int32).reshape(-1, 3)
+        indices = np.empty(len(colors), dtype=np.intp)
+        # Perceptual distances keep a few float temporaries per pair, so they go in smaller chunks
+        chunk_size = self.CHUNK_SIZE if self.metric == "rgb" else max(1, self.CHUNK_SIZE * 4 // len(self.palette))
+        for start in range(0, len(colors), chunk_size):
+            indices[start:start + chunk_size] = self.distances(colors[start:start + chunk_size]).argmin(axis=1)
+        return indices
+
+    def match(self, colors):
+        # Returns the palette index of every color and how many of them needed exact refinement
+        colors = np.asarray(colors).reshape(-1, 3)
+        if self.metric != "rgb":
+            return self._match_table(colors)
+        cells = (colors >> self.shift).astype(np.intp)
+        indices = self.lut[cells[:, 0], cells[:, 1], cells[:, 2]].astype(np.intp)
+        ambiguous = np.flatnonzero(indices < 0)
+        palette = self.palette.astype(np.int32)
+        for start in range(0, len(ambiguous), self.CHUNK_SIZE):
+            chunk = ambiguous[start:start + self.CHUNK_SIZE]
+            candidates = self.candidates[cells[chunk, 0], cells[chunk, 1], cells[chunk, 2]].astype(np.intp)
+            distances = ((colors[chunk, None, :].astype(np.int32) - palette[candidates]) ** 2).sum(axis=-1)
+            indices[chunk] = candidates[np.arange(len(chunk)), distances.argmin(axis=1)]
+        return indices, len(ambiguous)
+
+    def _match_table(self, colors):
+        # Entries hold palette index + 1, 0 is a color not measured yet. np.zeros leaves the pages of the table
+        # unallocated until they are written, so it only costs memory for the colors actually seen.
+        if self.table is None:
+            self.table = np.zeros(1 << 24, dtype=self.table_dtype(len(self.palette)))
+        table = self.table
+        keys = (colors[:, 0].astype(np.intp) << 16) | (colors[:, 1].astype(np.intp) << 8) | colors[:, 2]
+        entries = table[keys]
+        missing = entries == 0
+        if missing.any():
+            new_keys = np.unique(keys[missing])
+            new_colors = np.stack([new_keys >> 16, (new_keys >> 8) & 255, new_keys & 255], axis=-1)
+            new_entries = (self.nearest(new_colors) + 1).astype(table.dtype)
+            # Threads filling the same color write the same value, so concurrent matches need no lock
+            table[new_keys] = new_entries
+            entries[missing] = new_entries[np.searchsorted(new_keys, keys[missing])]
+        return entries.astype(np.intp) - 1, int(missing.sum())
+
+    @staticmethod
+    def table_dtype(palette_size):
+        # Entries hold palette index + 1, small palettes fit a byte
+        return np.uint8 if palette_size < 256 else np.uint16
+
+    def fill_table(self, map=map):
+        # Measures every 24-bit color once, a slab of 65536 colors per red value. map can be an executor's map to
+        # spread the slabs over processes.
+        table = np.empty(1 << 24, dtype=self.table_dtype(len(self.palette)))
+        slabs = map(_table_slab, repeat(self.palette), repeat(self.metric), range(256))
+        for red, entries in enumerate(slabs):
+            table[red << 16:(red + 1) << 16] = entries
+        self.table = table
+        self.complete = True
+
+    def map(self, colors):
+        indices, _ = self.match(colors)
+        return self.palette[indices]
+
+
+def _table_slab(palette, metric, red):
+    # Table entries of every color with this red value, module level so process pools can run it
+    palette_index = PaletteIndex(palette, metric=metric)
+    green, blue = np.divmod(np.arange(1 << 16), 256)
+    colors = np.stack([np.full(1 << 16, red), green, blue], axis=-1)
+    return (palette_index.nearest(colors) + 1).astype(PaletteIndex.table_dtype(len(palette)))
@@ -0,0 +1,154 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+import numpy as np
+from PIL import Image
+from BuildManifest import run_incremental
+from ImageManipulator import DEFAULT_MEMORY_BUDGET, ImageManipulator, OperationCanceled, OperationResult
+from PaletteCache import PaletteCache
+from PaletteIndex import PaletteIndex
+from Recorder import NULL_RECORDER, Recorder
+from StageCache import StageCache
+
+# Per-process pixelator and run state, set up once by the pool initializer
+_worker = None
+_cancel_event = None
+_memory_budget = None
+
+
+def _init_worker(palette, bits, lut, candidates, cancel_event, memory_budget, metric="rgb", table=None):
+    # The palette LUT, or the exact table of the other metrics, is built once in the parent and handed to every worker
+    # instead of being rebuilt per process
+    global _worker, _cancel_event, _memory_budget
+    palette_cache = PaletteCache(bits=bits)
+    palette_cache.put(palette, PaletteIndex(palette, bits=bits, lut=lut, candidates=candidates, metric=metric,
+                                            table=table))
+    # Every worker sees different files, caching their stages would only hold memory
+    _worker = ImageManipulator(palette_cache, StageCache(max_entries=0))
+    _cancel_event = cancel_event
+    _memory_budget = memory_budget
+
+
+def _pixelate_file(file, settings, palette, instrumented=False):
+    # Tiled files also check the shared cancel event between strips. Returns the output path and the file's
+    # Recorder.snapshot() when instrumented.
+    recorder = Recorder() if instrumented else NULL_RECORDER
+    output = _worker.pixelate_image(file, settings['block_size'], settings['saturation'], settings['background'],
+                                    settings['palette'], palette, settings.get('brightness', 0),
+                                    settings.get('contrast', 0), _memory_budget, _cancel_event.is_set,
+                                    settings.get('background_mode', "most_common"), recorder,
+                                    settings.get('output_format', "rgba"), settings.get('compress_level'),
+                                    settings.get('optimize', False), settings.get('metric', "rgb"),
+                                    settings.get('dither', "none"))
+    return output, recorder.snapshot() if instrumented else None
+
+
+class ParallelPixelator:
+    # Fans pixelate_image out over a process pool. Events are put on a thread-safe queue in file order:
+    # ("progress", done, total) after each file and ("done", OperationResult) once the run is over.
+    # Canceling drops the files that have not started yet, failures are collected per file.
+    POLL_INTERVAL = 0.1
+    # Filling the exact table of a perceptual metric measures every 24-bit color, so it only pays off for batches that
+    # match at least as many blocks. Smaller ones let every worker measure just the colors it sees.
+    TABLE_FILL_BLOCKS = 1 << 24
+
+    def __init__(self, workers=None, palette_cache=None, memory_budget=None, stage_cache=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.palette_cache = palette_cache if palette_cache is not None else PaletteCache()
+        # Runs in this process share the stage cache, so exporting again after a tweak reuses the earlier stages
+        self.stage_cache = stage_cache if stage_cache is not None else StageCache()
+        self.memory_budget = memory_budget
+        self.cancel_event = multiprocessing.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self, files, settings, palette, progress_queue=None, recorder=None, incremental=False):
+        # recorder collects per-file records and totals, which also end up in result.metrics. incremental only
+        # pixelates the files whose content, settings or palette changed since the manifest of their output directory.
+        files = list(files)
+        if incremental:
+            result = run_incremental(files, ImageManipulator.pixelated_path, dict(settings, palette_colors=palette),
+                                     lambda changed: self.run(changed, settings, palette, None, recorder))
+            if progress_queue is not None:
+                progress_queue.put(("done", result))
+            return result
+        self.cancel_event.clear()
+
+        def report(done, total):
+            if progress_queue is not None:
+                progress_queue.put(("progress", done, total))
+
+        if self.workers <= 1 or len(files) <= 1:
+            pixelization = ImageManipulator(self.palette_cache, self.stage_cache)
+            result = pixelization.pixelate_images(files, settings, palette, progress=report,
+                                                  canceled=self.cancel_event.is_set, memory_budget=self.memory_budget,
+                                                  recorder=recorder)
+        else:
+            result = self._run_pool(files, settings, palette, report, recorder)
+
+        if progress_queue is not None:
+            progress_queue.put(("done", result))
+        return result
+
+    @staticmethod
+    def block_count(files, block_size):
+        # Blocks the batch matches against the palette, from the image headers. Unreadable files count as none, they
+        # fail later on their own.
+        count = 0
+        for file in files:
+            try:
+                with Image.open(file) as image:
+                    width, height = image.size
+            except (OSError, ValueError, Image.DecompressionBombError):
+                continue
+            count += -(-width // block_size) * -(-height // block_size)
+        return count
+
+    def _run_pool(self, files, settings, palette, report, recorder=None):
+        output_directory = os.path.join(os.path.dirname(files[0]), 'pixelated_images')
+        result = OperationResult("pixelate", files, output_directory, "Pixelated images saved successfully.")
+        metric = settings.get('metric', "rgb")
+        palette_index = self.palette_cache.get(palette, metric)
+        if palette_index.lut is None and not palette_index.complete and \
+                self.block_count(files, settings['block_size']) >= self.TABLE_FILL_BLOCKS:
+            # Filling an exact table is split over the pool's cores too, by slabs of red
+            with ProcessPoolExecutor(max_workers=self.workers) as builder:
+                palette_index = self.palette_cache.complete(palette, metric, map=builder.map)
+        lut, candidates = (None, None) if palette_index.lut is None else (np.asarray(palette_index.lut),
+                                                                            np.asarray(palette_index.candidates))
+        # A table that is still filling lazily would only be copied to every worker mostly empty
+        table = np.asarray(palette_index.table) if palette_index.complete else None
+        workers = min(self.workers, len(files))
+        # The workers pixelate at the same time, each one gets an even share of the budget
+        memory_budget = (self.memory_budget or DEFAULT_MEMORY_BUDGET) // workers
+        initargs = (palette, palette_index.bits, lut, candidates, self.cancel_event, memory_budget, metric, table)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+            futures = [executor.submit(_pixelate_file, file, settings, palette, recorder is not None)
+                       for file in files]
+            for i, (file, future) in enumerate(zip(files, futures)):
+                # Wait for the files in order, checking for a cancel request while waiting
+                while not future.done() and not self.cancel_event.is_set():
+                    wait([future], timeout=self.POLL_INTERVAL)
+                if not future.done():
+                    result.canceled = True
+                    for pending in futures[i:]:
+                        pending.cancel()
+                    break
+                try:
+                    output, snapshot = future.result()
+                    result.outputs.append(output)
+                    if recorder is not None:
+                        recorder.add_record(file, snapshot)
+                except OperationCanceled:
+                    result.canceled = True
+                    break
+                except Exception as e:
+                    result.add_failure(file, e)
+                    if recorder is not None:
+                        recorder.add_record(file, status="failed")
+                report(i + 1, len(files))
+        if recorder is not None:
+            result.metrics = recorder.snapshot()
+        return result
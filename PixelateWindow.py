@@ -1,17 +1,22 @@
+import queue
 import threading
 from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk
 import os
 import tkinter as tk
 import json
 from CustomWidgets import CustomProgressBar
-from Functions import export_message, BG_COLOR, PALETTES, FG_COLOR
-from ImageManipulator import ImageManipulator
+from Functions import export_message, show_result, get_palette, BG_COLOR, PALETTES, FG_COLOR, CACHE_DIR
+from ImageManipulator import DITHER_MODES, ImageManipulator
+from PaletteCache import PaletteCache
+from PaletteIndex import METRICS
+from ParallelPixelator import ParallelPixelator
+from PreviewRenderer import PreviewRenderer
+from Recorder import Recorder
 
 
 class PixelateWindow:
     def __init__(self, root, files):
-        self.pixelization = ImageManipulator()
+        self.pixelization = ImageManipulator(PaletteCache(CACHE_DIR))
         self.preview_photo = None
         self.files = files
         self.pixelate_window = tk.Toplevel(root)
@@ -24,15 +29,18 @@ class PixelateWindow:
                                         height=200)
         self.preview_canvas.grid(row=0, column=1, padx=10, pady=5)
         self.values = {'block_size': 8, 'saturation': 0, 'brightness': 0, 'contrast': 0, 'palette': '',
-                       'background': 0}
+                       'background': 1}
         self.block_size_label = tk.Label(self.pixelate_window, text="Block Size", bg=BG_COLOR, fg=FG_COLOR)
         self.block_size_label.grid(row=1, column=0, padx=10, pady=5)
         self.block_size_scale = tk.Scale(self.pixelate_window, from_=1, to=20, orient="horizontal", bg=BG_COLOR,
                                          fg=FG_COLOR)
         self.block_size_scale.set(self.values['block_size'])
         self.block_size_scale.grid(row=1, column=1, padx=10, pady=5)
-        self.canceled = False
-
+        self.parallel_pixelator = ParallelPixelator(palette_cache=self.pixelization.closest_color_cache,
+                                                    stage_cache=self.pixelization.stage_cache)
+        self.preview_renderer = PreviewRenderer(self.pixelate_window, self.show_preview,
+                                                self.pixelization.closest_color_cache)
+        self.progress_queue = queue.Queue()
 
 
         def create_slider(label_text, default_value, row):
@@ -78,6 +86,43 @@ class PixelateWindow:
         self.remove_background_checkbutton.grid(row=7, column=1)
         self.remove_background_checkbutton.select()
 
+        # Palette PNGs hold the same pixels in a fraction of the size and encode faster
+        self.indexed_output_var = tk.StringVar(value="rgba")
+        self.indexed_output_checkbutton = tk.Checkbutton(self.pixelate_window, text="Indexed PNG",
+                                                         variable=self.indexed_output_var,
+                                                         onvalue="indexed", offvalue="rgba", bg=BG_COLOR, fg=FG_COLOR,
+                                                         selectcolor="black")
+        self.indexed_output_checkbutton.grid(row=8, column=1)
+
+        # Perceptual distances match muted palettes better, their lookup table fills up once per palette
+        self.metric_label = tk.Label(self.pixelate_window, text="Color Distance:", bg=BG_COLOR, fg=FG_COLOR)
+        self.metric_label.grid(row=9, column=0, padx=10, pady=5)
+        self.metric_var = tk.StringVar(value=METRICS[0])
+        self.metric_menu = tk.OptionMenu(self.pixelate_window, self.metric_var, *METRICS)
+        self.metric_menu.configure(bg=BG_COLOR, fg=FG_COLOR)
+        self.metric_menu.grid(row=9, column=1, padx=10, pady=5)
+
+        # Dithering mixes palette colors across neighbouring blocks instead of banding on small palettes
+        self.dither_label = tk.Label(self.pixelate_window, text="Dithering:", bg=BG_COLOR, fg=FG_COLOR)
+        self.dither_label.grid(row=10, column=0, padx=10, pady=5)
+        self.dither_var = tk.StringVar(value=DITHER_MODES[0])
+        self.dither_menu = tk.OptionMenu(self.pixelate_window, self.dither_var, *DITHER_MODES)
+        self.dither_menu.configure(bg=BG_COLOR, fg=FG_COLOR)
+        self.dither_menu.grid(row=10, column=1, padx=10, pady=5)
+
+        # Encoding only changes the file size and export time, not the pixels, so the preview ignores it
+        self.compress_level_label = tk.Label(self.pixelate_window, text="PNG Compression", bg=BG_COLOR, fg=FG_COLOR)
+        self.compress_level_label.grid(row=11, column=0, padx=10, pady=5)
+        self.compress_level_scale = tk.Scale(self.pixelate_window, from_=0, to=9, orient="horizontal", bg=BG_COLOR,
+                                             fg=FG_COLOR, length=200)
+        self.compress_level_scale.set(6)
+        self.compress_level_scale.grid(row=11, column=1, padx=10, pady=5)
+        self.optimize_var = tk.IntVar()
+        self.optimize_checkbutton = tk.Checkbutton(self.pixelate_window, text="Optimize PNG (slower)",
+                                                   variable=self.optimize_var, onvalue=1, offvalue=0, bg=BG_COLOR,
+                                                   fg=FG_COLOR, selectcolor="black")
+        self.optimize_checkbutton.grid(row=12, column=1)
+
         self.pixelate_button = tk.Button(self.pixelate_window, text="Pixelate",
                                          bg="#17a2b8", fg="white", relief="flat", padx=10,
                                          command=self.start_pixelation_thread)
@@ -101,10 +146,11 @@ class PixelateWindow:
         self.load_settings_button.grid(row=7, column=0, pady=5, sticky="n")
 
         self.palette_var.trace("w", lambda *args: self.update_preview())  # Bind to palette dropdown
-        self.block_size_scale.bind("<ButtonRelease-1>", lambda *args: self.update_preview())  # Bind to block size scale
-        self.saturation_scale.bind("<ButtonRelease-1>", lambda *args: self.update_preview())  # Bind to saturation scale
-        self.brightness_scale.bind("<ButtonRelease-1>", lambda *args: self.update_preview())  # Bind to saturation scale
-        self.contrast_scale.bind("<ButtonRelease-1>", lambda *args: self.update_preview())  # Bind to saturation scale
+        self.metric_var.trace("w", lambda *args: self.update_preview())
+        self.dither_var.trace("w", lambda *args: self.update_preview())
+        # Scales update the preview while dragging, the renderer only keeps up with the latest position
+        for scale in (self.block_size_scale, self.saturation_scale, self.brightness_scale, self.contrast_scale):
+            scale.config(command=lambda *args: self.update_preview())
         self.update_preview()  # Update the preview initially
         self.pixelate_button.config(state="disabled")
 
@@ -118,7 +164,8 @@ class PixelateWindow:
         # If the user cancels the dialog, return None
         if not file_path:
             return None
-        # Export the current settings to a JSON file
+        # Export the current settings to a JSON file, the encoding controls do not refresh the preview
+        self.values = self.read_settings()
         with open(file_path, 'w') as json_file:
             json.dump(self.values, json_file)
         # Get the directory path
@@ -143,57 +190,43 @@ class PixelateWindow:
             self.contrast_scale.set(self.values['contrast'])
             self.palette_var.set(self.values['palette'])
             self.remove_background_var.set(self.values['background'])
+            self.indexed_output_var.set(self.values.get('output_format', "rgba"))
+            self.metric_var.set(self.values.get('metric', METRICS[0]))
+            self.dither_var.set(self.values.get('dither', DITHER_MODES[0]))
+            compress_level = self.values.get('compress_level')
+            self.compress_level_scale.set(6 if compress_level is None else compress_level)
+            self.optimize_var.set(int(bool(self.values.get('optimize', False))))
             self.update_preview()
         except:
             messagebox.showerror("Error", f"File could not be read.")
 
     def update_preview(self):
-        # Load the first chosen exported image
+        # Rendering happens on the preview renderer's thread, show_preview gets the result
         if self.files:
-            first_image_path = self.files[0]
-            image = Image.open(first_image_path)
-
-            # Get parameters
-            block_size = self.block_size_scale.get()
-            saturation = self.saturation_scale.get()
-            brightness = self.brightness_scale.get()
-            contrast = self.contrast_scale.get()
-            background = self.remove_background_var.get()
-
-            selected_palette = next((p["colors"] for p in PALETTES if p["name"] == self.palette_var.get()), None)
-            # if self.values['block_size'] != block_size or self.values['palette'] != selected_palette:
-            # Pixelate the image
+            self.values = self.read_settings()
             if self.initial:
-                self.preview_photo = self.pixelization.pixelate(image, block_size, self.palette_var.get(), selected_palette,
-                                                   resize=False)
-                self.preview_photo = self.pixelization.adjust_saturation(self.preview_photo, saturation)
-                self.preview_photo = self.pixelization.adjust_brightness(self.preview_photo, brightness)
-                self.preview_photo = self.pixelization.adjust_contrast(self.preview_photo, contrast)
+                self.preview_renderer.request(self.files[0], dict(self.values), get_palette(self.palette_var.get()))
             else:
-                # Convert the PIL Image to a Tkinter PhotoImage
-                self.preview_photo = image
+                # The first preview shows the source as it is
+                self.preview_renderer.request(self.files[0])
                 self.initial = True
-
-            # Resize the image to fit within the maximum width and height while maintaining aspect ratio
-            self.preview_photo.thumbnail((300, 300))
-            width, height = self.preview_photo.size
-
-            self.preview_photo = ImageTk.PhotoImage(self.preview_photo)
-
-            # Update the preview canvas
-            self.preview_canvas.delete("all")
-
-            self.preview_canvas.config(width=width,
-                                       height=height)
-            self.preview_canvas.create_image(0, 0, anchor="nw", image=self.preview_photo)
-
-            self.values = {'block_size': block_size, 'saturation': saturation, 'brightness': brightness,
-                           'contrast': contrast,
-                           'palette': next((p["name"] for p in PALETTES if p["name"] == self.palette_var.get()),
-                                           None),
-                           'background': background}
         self.pixelate_button.config(state="normal")
 
+    def read_settings(self):
+        # Widgets are only read on the Tk thread
+        return {'block_size': self.block_size_scale.get(), 'saturation': self.saturation_scale.get(),
+                'brightness': self.brightness_scale.get(), 'contrast': self.contrast_scale.get(),
+                'palette': next((p["name"] for p in PALETTES if p["name"] == self.palette_var.get()), None),
+                'background': self.remove_background_var.get(), 'output_format': self.indexed_output_var.get(),
+                'compress_level': self.compress_level_scale.get(), 'optimize': bool(self.optimize_var.get()),
+                'metric': self.metric_var.get(), 'dither': self.dither_var.get()}
+
+    def show_preview(self, photo):
+        self.preview_photo = photo
+        self.preview_canvas.delete("all")
+        self.preview_canvas.config(width=photo.width(), height=photo.height())
+        self.preview_canvas.create_image(0, 0, anchor="nw", image=self.preview_photo)
+
     def print_canvas_dimensions(self):
         print(self.preview_canvas.winfo_width(), self.preview_canvas.winfo_height())
 
@@ -227,59 +260,47 @@ class PixelateWindow:
         # Disable the pixelate button during pixelation
         self.pixelate_button.config(state=tk.DISABLED)
         self.disable_buttons("disabled")
-        self.canceled = False
-        # Start a new thread for pixelation
-        threading.Thread(target=self.pixelate_images).start()
-
-    def pixelate_images(self):
-        block_size = self.block_size_scale.get()
-        saturation = self.saturation_scale.get()
-        remove_background = self.remove_background_var.get()
 
-        # Get selected palette
-        selected_palette = next((p["colors"] for p in PALETTES if p["name"] == self.palette_var.get()), None)
+        settings = self.read_settings()
 
         # Progress bar
         self.progress_bar = CustomProgressBar(self.pixelate_window, self.cancel_pixelation)  # Pass cancel handler
         self.progress_bar.update_progress(0, len(self.files))
 
-        # Disable the pixelate button
-        self.pixelate_button.config(state=tk.DISABLED)
+        # Start a new thread that runs the process pool, progress comes back through self.progress_queue
+        threading.Thread(target=self.pixelate_images, args=(settings,), daemon=True).start()
+        self.poll_progress()
 
-        # Pixelate images
-        for i, file in enumerate(self.files):
-            if self.canceled:
-                break
-            self.pixelate_image(file, block_size, saturation, remove_background,
-                                self.palette_var.get(), selected_palette)
-            # Update progress bar
-            self.progress_bar.update_progress(i + 1, len(self.files))
-            self.pixelate_window.update_idletasks()
+    def pixelate_images(self, settings):
+        # Get selected palette
+        selected_palette = get_palette(settings['palette'])
+        # Instrumented so the result dialog can tell where the time went
+        self.parallel_pixelator.run(self.files, settings, selected_palette, self.progress_queue, Recorder())
 
+    def poll_progress(self):
+        try:
+            while True:
+                event = self.progress_queue.get_nowait()
+                if event[0] == "progress":
+                    self.progress_bar.update_progress(event[1], event[2])
+                else:
+                    self.finish_pixelation(event[1])
+                    return
+        except queue.Empty:
+            pass
+        self.pixelate_window.after(50, self.poll_progress)
+
+    def finish_pixelation(self, result):
         # Cleanup
         self.disable_buttons("normal")
         self.progress_bar.destroy()
-        self.canceled = False  # Reset cancel flag
         self.pixelate_button.config(state=tk.NORMAL)
-        export_message(self.files, message="Pixelated images saved successfully.")
+        if result.metrics:
+            result.message += "\n\n" + Recorder.format_summary(result.metrics)
+        show_result(result)
 
     def cancel_pixelation(self):
-        self.canceled = True
-
-    def pixelate_image(self, image_path, block_size, saturation, remove_background, palette_name, palette):
-        image = Image.open(image_path)
-
-        # Directory
-        output_dir = os.path.join(os.path.dirname(image_path), 'pixelated_images')
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        output_path = os.path.join(output_dir, os.path.basename(image_path))
-
-        if remove_background:
-            image = ImageManipulator.remove_img_background(image)
-        pixelated_image = self.pixelization.pixelate(image, block_size, palette_name, palette)
-        pixelated_image = self.pixelization.adjust_saturation(pixelated_image, saturation)
-        pixelated_image.save(output_path)
+        self.parallel_pixelator.cancel()
 
     def disable_buttons(self, state):
         self.pixelate_button.config(state=state)
@@ -0,0 +1,252 @@
+import io
+import os
+import struct
+import zlib
+import numpy as np
+from PIL import Image
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# PNG color type -> channels per pixel
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# Bytes per pixel -> 8-bit color type that unfilters with the same byte distance, used to get raw scanline bytes back
+RAW_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+# Output mode -> PNG color type
+MODE_COLOR_TYPES = {"L": 0, "RGB": 2, "LA": 4, "RGBA": 6}
+
+
+def _chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def _png(width, height, bit_depth, color_type, scanlines, extra_chunks=b""):
+    # A tiny standalone PNG around already filtered scanlines, stored without compression
+    header = struct.pack(">IIBBBBB", width, height, bit_depth, color_type, 0, 0, 0)
+    return (PNG_SIGNATURE + _chunk(b"IHDR", header) + extra_chunks + _chunk(b"IDAT", zlib.compress(scanlines, 0)) +
+            _chunk(b"IEND", b""))
+
+
+def rewrite_palette(path, output_path, recolor):
+    # Copies an indexed PNG chunk by chunk with only PLTE and tRNS replaced, recolor maps (colors (N, 3), alpha (N,))
+    # to the new pair. The image data is never decoded.
+    temp_path = f"{output_path}.{os.getpid()}.partial"
+    try:
+        with PngStripReader(path) as reader, open(temp_path, "wb") as output:
+            if reader.color_type != 3:
+                raise ValueError("not an indexed PNG file")
+            colors, alpha = reader.palette()
+            colors, alpha = recolor(colors, alpha)
+            palette_chunks = _chunk(b"PLTE", colors.astype(np.uint8).tobytes())
+            transparent = np.flatnonzero(alpha < 255)
+            if len(transparent):
+                palette_chunks += _chunk(b"tRNS", alpha[:transparent[-1] + 1].astype(np.uint8).tobytes())
+            output.write(PNG_SIGNATURE + reader.header)
+            for chunk_type, data in reader.chunks():
+                if chunk_type == b"PLTE":
+                    output.write(palette_chunks)
+                elif chunk_type != b"tRNS":
+                    output.write(_chunk(chunk_type, data))
+        os.replace(temp_path, output_path)
+    finally:
+        # Only still there when the copy failed, so a bad input never leaves a .partial file behind
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+
+class PngStripReader:
+    # Decodes a PNG a strip of rows at a time, so only the current strip is ever held in memory. The zlib stream is
+    # inflated incrementally, each strip is unfiltered by PIL as a small PNG that starts with the previous raw row.
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        try:
+            if self.file.read(8) != PNG_SIGNATURE:
+                raise ValueError("not a PNG file")
+            self.extra_chunks = b""
+            self.leading_chunks = []
+            self.pending_idat = None
+            while self.pending_idat is None:
+                chunk_type, data = self._read_chunk()
+                if chunk_type not in (b"IHDR", b"IDAT"):
+                    self.leading_chunks.append((chunk_type, data))
+                if chunk_type == b"IHDR":
+                    self.header = _chunk(chunk_type, data)
+                    (self.width, self.height, self.bit_depth, self.color_type, _, _,
+                     self.interlace) = struct.unpack(">IIBBBBB", data)
+                elif chunk_type in (b"PLTE", b"tRNS"):
+                    self.extra_chunks += _chunk(chunk_type, data)
+                    setattr(self, chunk_type.decode().lower(), data)
+                elif chunk_type == b"IDAT":
+                    self.pending_idat = data
+                elif chunk_type == b"IEND":
+                    raise ValueError("PNG file has no image data")
+        except Exception:
+            self.file.close()
+            raise
+        bits_per_pixel = self.bit_depth * CHANNELS[self.color_type]
+        self.pixel_bytes = max(1, bits_per_pixel // 8)
+        self.row_bytes = (self.width * bits_per_pixel + 7) // 8
+        self.size = (self.width, self.height)
+
+    @staticmethod
+    def supported(path):
+        # Interlaced images and pixels wider than 4 bytes (16-bit RGB/RGBA) are left to the whole-image path
+        try:
+            with PngStripReader(path) as reader:
+                return not reader.interlace and reader.pixel_bytes in RAW_COLOR_TYPES
+        except (OSError, ValueError, KeyError, struct.error):
+            return False
+
+    def palette(self):
+        # Colors (N, 3) and alpha (N,) of an indexed PNG
+        colors = np.frombuffer(getattr(self, "plte", b""), dtype=np.uint8).reshape(-1, 3)
+        alpha = np.full(len(colors), 255, dtype=np.uint8)
+        entries = np.frombuffer(getattr(self, "trns", b""), dtype=np.uint8)[:len(colors)]
+        alpha[:len(entries)] = entries
+        return colors, alpha
+
+    def chunks(self):
+        # Every chunk after IHDR as it is stored, in file order
+        yield from self.leading_chunks
+        yield b"IDAT", self.pending_idat
+        self.pending_idat = None
+        while True:
+            chunk_type, data = self._read_chunk()
+            yield chunk_type, data
+            if chunk_type == b"IEND":
+                return
+
+    def _read_chunk(self):
+        header = self.file.read(8)
+        if len(header) < 8:
+            raise ValueError("truncated PNG file")
+        length, chunk_type = struct.unpack(">I4s", header)
+        data = self.file.read(length)
+        self.file.read(4)  # CRC
+        return chunk_type, data
+
+    def _idat(self):
+        # Yields the compressed image data chunk by chunk
+        if self.pending_idat is not None:
+            data, self.pending_idat = self.pending_idat, None
+            yield data
+        while True:
+            chunk_type, data = self._read_chunk()
+            if chunk_type == b"IDAT":
+                yield data
+            elif chunk_type == b"IEND":
+                return
+
+    def strips(self, rows):
+        # Yields (y, PIL image) for consecutive strips of at most `rows` rows
+        idat = self._idat()
+        decompressor = zlib.decompressobj()
+        filtered = bytearray()
+        previous = None
+        y = 0
+        while y < self.height:
+            count = min(rows, self.height - y)
+            needed = count * (self.row_bytes + 1)
+            while len(filtered) < needed:
+                data = decompressor.unconsumed_tail or next(idat, b"")
+                if not data:
+                    raise ValueError("truncated PNG image data")
+                filtered += decompressor.decompress(data, needed - len(filtered))
+            scanlines = bytes(filtered[:needed])
+            del filtered[:needed]
+
+            raw = self._unfilter(scanlines, count, previous)
+            previous = raw[-1]
+            yield y, self._image(raw, count)
+            y += count
+
+    def _unfilter(self, scanlines, count, previous):
+        # Prepending the previous raw row unfiltered (filter type 0) lets PIL resolve Up/Average/Paeth exactly
+        if previous is not None:
+            scanlines = b"\x00" + previous.tobytes() + scanlines
+            count += 1
+        raw_width = self.row_bytes // self.pixel_bytes
+        raw = np.asarray(Image.open(io.BytesIO(_png(raw_width, count, 8, RAW_COLOR_TYPES[self.pixel_bytes],
+                                                    scanlines))))
+        raw = raw.reshape(count, self.row_bytes)
+        return raw[1:] if previous is not None else raw
+
+    def _image(self, raw, count):
+        if self.bit_depth == 8 and self.color_type != 3 and not self.extra_chunks:
+            channels = CHANNELS[self.color_type]
+            return Image.fromarray(raw.reshape((count, self.width, channels) if channels > 1 else (count, self.width)))
+        # Palettes, transparency chunks and packed bit depths are left to PIL's own PNG decoding
+        scanlines = np.hstack([np.zeros((count, 1), dtype=np.uint8), raw]).tobytes()
+        image = Image.open(io.BytesIO(_png(self.width, count, self.bit_depth, self.color_type, scanlines,
+                                           self.extra_chunks)))
+        image.load()
+        return image
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PngStripWriter:
+    # Encodes a PNG a strip of rows at a time. Output goes to a temporary file that only replaces `path` once the
+    # image is complete, so a canceled or failed run never leaves a truncated PNG behind.
+    def __init__(self, path, size, compress_level=6):
+        self.path = path
+        self.width, self.height = size
+        self.temp_path = f"{path}.{os.getpid()}.partial"
+        self.file = open(self.temp_path, "wb")
+        self.compressor = zlib.compressobj(compress_level)
+        self.previous = None
+        self.rows_written = 0
+
+    def write(self, image):
+        rows = np.asarray(image)
+        if rows.ndim == 2:
+            rows = rows[:, :, None]
+        if self.previous is None:
+            channels = rows.shape[2]
+            mode = image.mode if isinstance(image, Image.Image) else {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}[channels]
+            header = struct.pack(">IIBBBBB", self.width, self.height, 8, MODE_COLOR_TYPES[mode], 0, 0, 0)
+            self.file.write(PNG_SIGNATURE + _chunk(b"IHDR", header))
+            self.previous = np.zeros((1,) + rows.shape[1:], dtype=np.uint8)
+
+        # Up filter: every row is stored as its difference to the row above
+        filtered = np.diff(np.concatenate([self.previous, rows]), axis=0).reshape(len(rows), -1)
+        scanlines = np.hstack([np.full((len(rows), 1), 2, dtype=np.uint8), filtered])
+        self.previous = rows[-1:].copy()
+        self.rows_written += len(rows)
+        self._write_idat(self.compressor.compress(scanlines.tobytes()))
+
+    def _write_idat(self, data):
+        if data:
+            self.file.write(_chunk(b"IDAT", data))
+
+    def close(self):
+        if self.rows_written != self.height:
+            self.abort()
+            raise ValueError(f"wrote {self.rows_written} of {self.height} rows")
+        self._write_idat(self.compressor.flush())
+        self.file.write(_chunk(b"IEND", b""))
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,113 @@
+import queue
+import threading
+from PIL import Image, ImageTk
+from ImageManipulator import ImageManipulator
+from StageCache import StageCache
+
+PREVIEW_SIZE = (300, 300)
+
+
+class PreviewRenderer:
+    # Renders the Pixelate window preview on a background thread. The source is decoded once and every render works on
+    # a small proxy instead of the full image, so its cost follows the display size and not the source size. Requests
+    # that were not started yet are dropped in favour of the latest one, and the finished PhotoImage is handed to
+    # on_ready on the Tk thread through after().
+    POLL_INTERVAL = 15
+    # The reduced copy of the source is at most this many times the display size
+    BASE_SCALE = 4
+
+    def __init__(self, widget, on_ready, palette_cache=None, display_size=PREVIEW_SIZE):
+        self.widget = widget
+        self.on_ready = on_ready
+        self.pixelization = ImageManipulator(palette_cache, StageCache(max_entries=16))
+        self.display_size = display_size
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pending = None
+        self.generation = 0
+        self.results = queue.Queue()
+        self.polling = False
+        # Only touched by the worker thread
+        self.source_key = None
+        self.source_size = None
+        self.base = None
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def request(self, path, settings=None, palette=None):
+        # Called on the Tk thread. settings is the PixelateWindow.values dict, None shows the source unprocessed.
+        with self.lock:
+            self.generation += 1
+            self.pending = (self.generation, path, settings, palette)
+        self.wake.set()
+        if not self.polling:
+            self.polling = True
+            self.widget.after(self.POLL_INTERVAL, self._poll)
+
+    def _run(self):
+        while True:
+            self.wake.wait()
+            with self.lock:
+                request, self.pending = self.pending, None
+                self.wake.clear()
+            if request is None:
+                continue
+            generation, path, settings, palette = request
+            try:
+                image = self.render(path, settings, palette)
+            except Exception as e:
+                image = e
+            self.results.put((generation, image))
+
+    def _poll(self):
+        # Only the result of the newest request is shown, older ones finished while the user kept dragging
+        latest = None
+        try:
+            while True:
+                latest = self.results.get_nowait()
+        except queue.Empty:
+            pass
+        if latest is None or latest[0] != self.generation:
+            self.widget.after(self.POLL_INTERVAL, self._poll)
+            return
+        self.polling = False
+        if isinstance(latest[1], Exception):
+            raise latest[1]
+        self.on_ready(ImageTk.PhotoImage(latest[1]))
+
+    def render(self, path, settings=None, palette=None):
+        self._load(path)
+        display_size = self._fit(self.source_size)
+        if settings is None:
+            return self.base.resize(display_size, Image.BOX)
+
+        # Pixelating the display size times the block size and shrinking the result to the display averages the same
+        # pixels as pixelating an area-averaged proxy of the block grid at block size 1, which is far cheaper
+        block_size = settings['block_size']
+        width, height = self.source_size
+        proxy_size = (min(-(-width // block_size), display_size[0]), min(-(-height // block_size), display_size[1]))
+        # Stages are cached, moving one slider only reruns the stages after it
+        image = self.pixelization.pixelate_stages((self.source_key, self.display_size, proxy_size),
+                                                  lambda: self.base.resize(proxy_size, Image.BOX), 1,
+                                                  settings['palette'], palette, settings['saturation'],
+                                                  settings['brightness'], settings['contrast'],
+                                                  metric=settings.get('metric', "rgb"),
+                                                  dither=settings.get('dither', "none"))
+        return image.resize(display_size, Image.NEAREST)
+
+    def _load(self, path):
+        # Decodes the source once and only keeps a reduced copy every render is sampled from
+        source_key = StageCache.file_key(path)
+        if source_key == self.source_key:
+            return
+        image = Image.open(path)
+        image = image if image.mode in ("RGB", "RGBA") else image.convert("RGBA")
+        base_size = (min(image.width, self.display_size[0] * self.BASE_SCALE),
+                     min(image.height, self.display_size[1] * self.BASE_SCALE))
+        self.base = image if base_size == image.size else image.resize(base_size, Image.BOX, reducing_gap=2.0)
+        self.source_size = image.size
+        self.source_key = source_key
+
+    def _fit(self, size):
+        # Same size thumbnail() would give: shrink to fit the display, never enlarge
+        scale = min(1, self.display_size[0] / size[0], self.display_size[1] / size[1])
+        return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
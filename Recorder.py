@@ -0,0 +1,105 @@
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+class Recorder:
+    # Opt-in instrumentation: wall time per stage, counters (bytes, cache hits and misses) and peak sizes. A batch
+    # recorder collects one record per file plus the totals, a disabled recorder does nothing so the engine can call it
+    # unconditionally. Safe to share between threads.
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.peaks = {}
+        self.records = []
+
+    def stage(self, name):
+        return self._timed(name) if self.enabled else nullcontext()
+
+    @contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds, calls=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            stage = self.stages.setdefault(name, [0, 0.0])
+            stage[0] += calls
+            stage[1] += seconds
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def peak(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.peaks[name] = max(self.peaks.get(name, 0), value)
+
+    def array(self, name, data):
+        # Peak bytes of an ndarray or a decoded image
+        if self.enabled:
+            self.peak(name, data.nbytes if hasattr(data, "nbytes") else data.width * data.height * len(data.getbands()))
+
+    def snapshot(self):
+        with self.lock:
+            return {'stages': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in
+                               self.stages.items()},
+                    'counters': dict(self.counters), 'peaks': dict(self.peaks)}
+
+    def merge(self, snapshot):
+        for name, stage in snapshot['stages'].items():
+            self.add_time(name, stage['seconds'], stage['calls'])
+        for name, amount in snapshot['counters'].items():
+            self.count(name, amount)
+        for name, value in snapshot['peaks'].items():
+            self.peak(name, value)
+
+    def add_record(self, file, snapshot=None, status="ok"):
+        # One file of a batch, its snapshot is added to the totals
+        if not self.enabled:
+            return
+        if snapshot is not None:
+            self.merge(snapshot)
+        with self.lock:
+            self.records.append(dict({'file': file, 'status': status}, **(snapshot or {})))
+
+    def write_jsonl(self, path):
+        # One line per file in completion order, then a line with the totals
+        with open(path, "w") as file:
+            with self.lock:
+                records = list(self.records)
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+            file.write(json.dumps(dict({'total': True, 'files': len(records)}, **self.snapshot())) + "\n")
+
+    @staticmethod
+    def format_summary(snapshot):
+        # Short text for the GUI: stages by time spent, then the counters
+        stages = sorted(snapshot['stages'].items(), key=lambda item: item[1]['seconds'], reverse=True)
+        total = sum(stage['seconds'] for _, stage in stages) or 1
+        lines = [f"{name}: {stage['seconds']:.2f}s ({stage['seconds'] / total:.0%})" for name, stage in stages]
+        counters = snapshot['counters']
+        for name in ("bytes_read", "bytes_written"):
+            if name in counters:
+                lines.append(f"{name.replace('_', ' ')}: {counters[name] / (1024 * 1024):.1f} MB")
+        if "stage_cache_hits" in counters or "stage_cache_misses" in counters:
+            lines.append(f"stage cache: {counters.get('stage_cache_hits', 0)} hits, "
+                         f"{counters.get('stage_cache_misses', 0)} misses")
+        if "lut_hits" in counters or "lut_refined" in counters:
+            lines.append(f"palette LUT: {counters.get('lut_hits', 0)} direct, {counters.get('lut_refined', 0)} refined")
+        return "\n".join(lines)
+
+
+NULL_RECORDER = Recorder(enabled=False)
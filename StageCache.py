@@ -0,0 +1,68 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class StageCache:
+    # Memoized results of the pixelation pipeline stages. Every entry is keyed by (stage name, stage parameters,
+    # upstream key), with the file identity at the root, so changing one parameter only recomputes the stages after it
+    # and an edited or different file never matches. Bounded LRU by entry count and by image bytes. Safe to share
+    # between threads, stages are computed outside the lock.
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, max_entries=32, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = self.DEFAULT_MAX_BYTES if max_bytes is None else max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def file_key(path):
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'bytes': self.total_bytes}
+
+    def contains(self, name, params, upstream):
+        with self.lock:
+            return (name, params, upstream) in self.entries
+
+    def stage(self, name, params, upstream, compute):
+        # Returns (key, value) and only calls compute() when this stage is not cached yet
+        key = (name, params, upstream)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return key, entry[0]
+            self.misses += 1
+
+        value = compute()
+        size = self._size(value)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return key, value
+        with self.lock:
+            if key in self.entries:
+                # Another thread computed the same stage meanwhile, keep the single cached copy
+                return key, self.entries[key][0]
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+        return key, value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    @staticmethod
+    def _size(image):
+        return image.width * image.height * len(image.getbands())
@@ -0,0 +1,209 @@
+import os
+import tempfile
+import numpy as np
+from PIL import Image
+from ImageManipulator import DEFAULT_MEMORY_BUDGET, ImageManipulator, OperationCanceled
+from PngStream import PngStripReader, PngStripWriter, rewrite_palette
+
+
+class TiledProcessor:
+    # Runs the per-file operations over block-aligned strips of rows, streaming the input PNG in and the output PNG
+    # out, so peak memory follows memory_budget instead of the image size. canceled is checked before every strip.
+    # Working bytes per decoded byte of a strip: RGBA conversion, int64 block sums and the expanded output
+    WORKING_BYTES = 24
+
+    def __init__(self, memory_budget=None, canceled=None):
+        self.memory_budget = memory_budget or DEFAULT_MEMORY_BUDGET
+        self.canceled = canceled
+
+    @staticmethod
+    def should_tile(path, memory_budget=None):
+        # Streams every image whose whole-image processing would not fit the budget, which takes the same working bytes
+        # per decoded RGBA byte as a strip. The header is read directly, Image.open would refuse the very images this
+        # is meant for as decompression bombs.
+        if not PngStripReader.supported(path):
+            return False
+        with PngStripReader(path) as reader:
+            decoded_bytes = reader.width * reader.height * 4
+        return decoded_bytes * TiledProcessor.WORKING_BYTES > (memory_budget or DEFAULT_MEMORY_BUDGET)
+
+    def strip_height(self, width, multiple=1):
+        rows = self.memory_budget // max(1, width * 4 * self.WORKING_BYTES)
+        return max(multiple, rows // multiple * multiple)
+
+    def strips(self, path, multiple=1):
+        with PngStripReader(path) as reader:
+            for y, strip in reader.strips(self.strip_height(reader.width, multiple)):
+                if self.canceled and self.canceled():
+                    raise OperationCanceled(path)
+                yield y, strip
+
+    def size(self, path):
+        with PngStripReader(path) as reader:
+            return reader.size
+
+    @staticmethod
+    def indexed(path):
+        with PngStripReader(path) as reader:
+            return reader.color_type == 3
+
+    def replace_colors(self, path, output_path, color_table):
+        # color_table comes from ImageManipulator.color_map_table. Indexed PNGs only have their palette rewritten.
+        if self.indexed(path):
+            return rewrite_palette(path, output_path,
+                                   lambda colors, alpha: ImageManipulator.map_palette(colors, alpha, color_table))
+        with PngStripWriter(output_path, self.size(path)) as writer:
+            for _, strip in self.strips(path):
+                writer.write(ImageManipulator.map_colors(strip, color_table))
+
+    def remove_color(self, path, output_path, color):
+        if self.indexed(path):
+            return rewrite_palette(path, output_path,
+                                   lambda colors, alpha: ImageManipulator.remove_palette_color(colors, alpha, color))
+        with PngStripWriter(output_path, self.size(path)) as writer:
+            for _, strip in self.strips(path):
+                writer.write(ImageManipulator.remove_color(strip.convert("RGBA"), color[:3]))
+
+    def packed_strips(self, path):
+        # Every pixel as one RGBA uint32, with the flat index of the strip's first pixel
+        for y, strip in self.strips(path):
+            yield y * strip.width, ImageManipulator.pack_rgba(strip.convert("RGBA")).ravel()
+
+    def most_common_color(self, path):
+        # Exact most common RGBA value in bounded memory. A mergeable Misra-Gries summary keeps every color that covers
+        # more than 1/capacity of the pixels, a second pass counts those candidates exactly. Only images where no color
+        # stands out that much fall back to counting hash partitions spilled to disk.
+        capacity = max(1024, self.memory_budget // 64)
+        keys = np.empty(0, dtype=np.uint32)
+        counts = np.empty(0, dtype=np.int64)
+        pending_keys, pending_counts = [], []
+        total = 0
+
+        def merge(keys, counts):
+            keys, inverse = np.unique(np.concatenate([keys] + pending_keys), return_inverse=True)
+            counts = np.bincount(inverse, weights=np.concatenate([counts] + pending_counts)).astype(np.int64)
+            del pending_keys[:], pending_counts[:]
+            if len(keys) > capacity:
+                # Subtract the (capacity + 1)-th largest count from every counter and drop the ones that run out
+                counts -= np.partition(counts, len(counts) - capacity - 1)[len(counts) - capacity - 1]
+                keys, counts = keys[counts > 0], counts[counts > 0]
+            return keys, counts
+
+        for _, packed in self.packed_strips(path):
+            strip_keys, strip_counts = np.unique(packed, return_counts=True)
+            pending_keys.append(strip_keys)
+            pending_counts.append(strip_counts)
+            total += len(packed)
+            if sum(len(pending) for pending in pending_keys) >= capacity:
+                keys, counts = merge(keys, counts)
+        keys, counts = merge(keys, counts)
+
+        exact = np.zeros(len(keys), dtype=np.int64)
+        for _, packed in (self.packed_strips(path) if len(keys) else ()):
+            positions = np.minimum(np.searchsorted(keys, packed), len(keys) - 1)
+            found = keys[positions] == packed
+            exact += np.bincount(positions[found], minlength=len(keys))
+        best_count = int(exact.max()) if len(keys) else 0
+        if best_count * (capacity + 1) > total:
+            best_keys = [int(key) for key in keys[exact == best_count]]
+        else:
+            best_keys = self._most_common_by_partitions(path, total)
+
+        # Ties go to the color seen first, like Counter.most_common
+        key = best_keys[0]
+        if len(best_keys) > 1:
+            for _, packed in self.packed_strips(path):
+                found = np.flatnonzero(np.isin(packed, best_keys))
+                if len(found):
+                    key = int(packed[found[0]])
+                    break
+        return ImageManipulator.unpack_rgba(key)
+
+    def _most_common_by_partitions(self, path, total):
+        # Spills every pixel into hash partitions on disk, each small enough to count exactly within the budget
+        partitions = max(1, -(-total * 4 * self.WORKING_BYTES // self.memory_budget))
+        best_count, best_keys = 0, []
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, f"{i}.bin") for i in range(partitions)]
+            files = [open(partition_path, "wb") for partition_path in paths]
+            try:
+                for _, packed in self.packed_strips(path):
+                    partition = ((packed * np.uint32(2654435761)) >> np.uint32(16)) % partitions
+                    order = np.argsort(partition, kind="stable")
+                    bounds = np.concatenate([[0], np.cumsum(np.bincount(partition, minlength=partitions))])
+                    packed = packed[order]
+                    for i in np.flatnonzero(np.diff(bounds)):
+                        files[i].write(packed[bounds[i]:bounds[i + 1]].tobytes())
+            finally:
+                for file in files:
+                    file.close()
+
+            for partition_path in paths:
+                keys, counts = np.unique(np.fromfile(partition_path, dtype=np.uint32), return_counts=True)
+                if not len(keys):
+                    continue
+                top = int(counts.max())
+                if top > best_count:
+                    best_count, best_keys = top, []
+                if top == best_count:
+                    best_keys += [int(key) for key in keys[counts == top]]
+        return best_keys
+
+    def remove_background(self, path, output_path):
+        self.remove_color(path, output_path, self.most_common_color(path))
+
+    def pixelate(self, path, output_path, block_size, palette_index, remove_background=False, resize=True,
+                 saturation=0, brightness=0, contrast=0, background_mode="most_common", compress_level=None,
+                 dither="none"):
+        # Strips hold whole rows of blocks, so every block is averaged exactly as in ImageManipulator.pixelate
+        if remove_background and background_mode != "most_common":
+            # Connectivity to the border is not known strip by strip
+            raise ValueError(f"background mode {background_mode!r} is not supported above the memory budget")
+        width, height = self.size(path)
+        background = self.most_common_color(path) if remove_background else None
+        if resize:
+            output_size = (int(width * (1 / block_size)), int(height * (1 / block_size)))
+            rows, columns = ImageManipulator.grid_samples((width, height), block_size)
+        else:
+            output_size = (width, height)
+
+        def strip_grids():
+            # (block grid, grid samples) of every strip that contributes output rows. Every strip is matched, error
+            # diffusion carries over into the next one.
+            carry = None
+            for y, strip in self.strips(path, block_size):
+                if background is not None:
+                    strip = ImageManipulator.remove_color(strip.convert("RGBA"), background)
+                elif strip.mode not in ("RGB", "RGBA"):
+                    strip = strip.convert("RGBA")
+                grid = ImageManipulator.block_averages(strip, block_size)
+                h_blocks, w_blocks, channels = grid.shape
+                if dither == "none":
+                    closest_colors, _ = ImageManipulator.match_blocks(grid.reshape(-1, channels), palette_index)
+                else:
+                    closest_colors, _, carry = ImageManipulator.dither_blocks(grid, palette_index, dither,
+                                                                              y // block_size, carry)
+                if resize:
+                    first = y // block_size
+                    strip_rows = rows[(rows >= first) & (rows < first + -(-strip.height // block_size))] - first
+                    if not len(strip_rows):
+                        continue
+                    samples = (strip_rows, columns)
+                else:
+                    samples = ImageManipulator.grid_samples(strip.size, block_size, False)
+                yield Image.fromarray(closest_colors.reshape(h_blocks, w_blocks, channels).astype(np.uint8)), samples
+
+        # Contrast blends towards the mean of the whole output, which takes a first pass over the grids to measure
+        mean = None
+        if contrast != 0:
+            histogram = np.zeros(256, dtype=np.int64)
+            lut = ImageManipulator.brightness_lut(brightness)
+            for grid, samples in strip_grids():
+                histogram += ImageManipulator.luminance_histogram(ImageManipulator.adjust_saturation(grid, saturation),
+                                                                  lut, ImageManipulator.grid_weights(grid, samples))
+            mean = ImageManipulator.contrast_mean(histogram)
+
+        with PngStripWriter(output_path, output_size, 6 if compress_level is None else compress_level) as writer:
+            for grid, samples in strip_grids():
+                grid = ImageManipulator.adjust_grid(grid, saturation, brightness, contrast, mean=mean)
+                writer.write(ImageManipulator.expand_grid(grid, samples))
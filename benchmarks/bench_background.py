@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+from collections import Counter
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ImageManipulator import ImageManipulator
+
+
+def reference_remove_background(image):
+    # The original detection: a Counter over every RGBA tuple
+    image = image.convert("RGBA")
+    max_color = Counter(image.getdata()).most_common(1)[0][0]
+    return ImageManipulator.remove_color(image, max_color)
+
+
+def sprite_sheet_image(width, height, seed=0):
+    # A flat background with noisy sprites on it, and background-colored pixels inside the sprites that border mode
+    # has to keep
+    rng = np.random.default_rng(seed)
+    data = np.zeros((height, width, 4), dtype=np.uint8)
+    data[:] = (40, 180, 90, 255)
+    for _ in range(max(1, width * height // 20000)):
+        x, y = rng.integers(0, width - 32), rng.integers(0, height - 32)
+        sprite = rng.integers(0, 256, (32, 32, 4), dtype=np.uint8)
+        sprite[:, :, 3] = 255
+        sprite[8:24, 8:24] = (40, 180, 90, 255)
+        data[y:y + 32, x:x + 32] = sprite
+    return Image.fromarray(data)
+
+
+def main():
+    for size in [(512, 512), (2048, 2048), (4096, 4096)]:
+        image = sprite_sheet_image(*size)
+
+        start = time.perf_counter()
+        expected = reference_remove_background(image)
+        reference_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = ImageManipulator.remove_img_background(image)
+        histogram_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ImageManipulator.remove_img_background(image, "border")
+        border_time = time.perf_counter() - start
+
+        identical = np.array_equal(np.asarray(expected), np.asarray(result))
+        print(f"{size[0]}x{size[1]}: Counter {reference_time:.3f}s, histogram {histogram_time:.3f}s "
+              f"({reference_time / histogram_time:.1f}x), border {border_time:.3f}s "
+              f"({reference_time / border_time:.1f}x), identical={identical}")
+
+
+if __name__ == "__main__":
+    main()
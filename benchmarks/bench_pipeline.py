@@ -0,0 +1,57 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from BatchPipeline import BatchPipeline
+from ImageManipulator import ImageManipulator
+from suite import synthetic_image
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        files = []
+        for i in range(16):
+            path = os.path.join(directory, f"{i}.png")
+            synthetic_image(1024, seed=i).save(path)
+            files.append(path)
+
+        def decode(file):
+            return ImageManipulator.open_image(file)
+
+        def compute(file, image):
+            return ImageManipulator.remove_img_background(image)
+
+        def encode(file, image):
+            output_path = os.path.join(directory, "out_" + os.path.basename(file))
+            image.save(output_path)
+            return output_path
+
+        # Each stage alone, then one after another per file, then overlapped
+        stage_times = [0.0, 0.0, 0.0]
+        start = time.perf_counter()
+        for file in files:
+            stage_start = time.perf_counter()
+            image = decode(file)
+            stage_times[0] += time.perf_counter() - stage_start
+            stage_start = time.perf_counter()
+            image = compute(file, image)
+            stage_times[1] += time.perf_counter() - stage_start
+            stage_start = time.perf_counter()
+            encode(file, image)
+            stage_times[2] += time.perf_counter() - stage_start
+        sequential_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        list(BatchPipeline().run(files, decode, compute, encode))
+        pipeline_time = time.perf_counter() - start
+
+        print(f"{len(files)} files, {os.cpu_count()} cores: decode {stage_times[0]:.2f}s, "
+              f"compute {stage_times[1]:.2f}s, encode {stage_times[2]:.2f}s")
+        print(f"sequential {sequential_time:.2f}s, pipeline {pipeline_time:.2f}s "
+              f"({sequential_time / pipeline_time:.2f}x, slowest stage alone {max(stage_times):.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
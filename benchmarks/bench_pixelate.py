@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Functions import PALETTES
+from ImageManipulator import ImageManipulator
+from suite import synthetic_image
+
+
+def reference_pixelate(image, block_size, palette, cache):
+    # The original per-block engine: one crop + mean and one paste per block
+    image = image.copy()
+    width, height = image.size
+    h_blocks = (height + block_size - 1) // block_size
+    w_blocks = (width + block_size - 1) // block_size
+    block_coords = [(i * block_size, j * block_size,
+                     min((i + 1) * block_size, width),
+                     min((j + 1) * block_size, height))
+                    for j in range(h_blocks) for i in range(w_blocks)]
+    for coords in block_coords:
+        region = np.array(image.crop(coords))
+        average_color = tuple(np.mean(region, axis=(0, 1)).astype(int))
+        if len(average_color) == 4 and average_color[3] == 0:
+            closest = average_color
+        else:
+            encoded_color = ImageManipulator._encode_color(average_color)
+            closest = cache.get(encoded_color)
+            if not closest:
+                closest = ImageManipulator.closest_color(average_color, palette)
+                cache[encoded_color] = closest
+        image.paste(tuple(int(c) for c in closest), coords)
+    return image.resize((int(width / block_size), int(height / block_size)), resample=Image.NEAREST)
+
+
+def reference_adjust(image, saturation, brightness, contrast):
+    # The original adjustments: separate full-resolution passes after pixelation
+    image = ImageManipulator.adjust_saturation(image, saturation)
+    image = ImageManipulator.adjust_brightness(image, brightness)
+    return ImageManipulator.adjust_contrast(image, contrast)
+
+
+def main():
+    palette = PALETTES[0]["colors"]
+    for size, block_size in [((257, 131), 3), ((640, 480), 4), ((1024, 1024), 8), ((1024, 1024), 2)]:
+        for mode in ("RGB", "RGBA"):
+            image = synthetic_image(*size, mode=mode)
+
+            start = time.perf_counter()
+            expected = reference_pixelate(image, block_size, palette, {})
+            reference_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            result = ImageManipulator().pixelate(image, block_size, PALETTES[0]["name"], palette)
+            vectorized_time = time.perf_counter() - start
+
+            identical = np.array_equal(np.asarray(expected), np.asarray(result))
+            print(f"{size[0]}x{size[1]} {mode} block={block_size}: per-block {reference_time:.3f}s, "
+                  f"vectorized {vectorized_time:.3f}s ({reference_time / vectorized_time:.1f}x), "
+                  f"identical={identical}")
+
+    # Saturation, brightness and contrast on the full-resolution output vs fused on the block grid
+    pixelization = ImageManipulator()
+    for size, block_size in [((2048, 2048), 4), ((4096, 4096), 8)]:
+        image = synthetic_image(*size)
+        pixelated = pixelization.pixelate(image, block_size, PALETTES[0]["name"], palette, False)
+        start = time.perf_counter()
+        expected = reference_adjust(pixelated, 30, 20, 40)
+        reference_time = time.perf_counter() - start
+
+        grid = pixelization.match_grid(image, block_size, PALETTES[0]["name"], palette)
+        samples = ImageManipulator.grid_samples(image.size, block_size, False)
+        start = time.perf_counter()
+        adjusted = ImageManipulator.adjust_grid(grid, 30, 20, 40, ImageManipulator.grid_weights(grid, samples))
+        fused_time = time.perf_counter() - start
+
+        identical = np.array_equal(np.asarray(expected), np.asarray(ImageManipulator.expand_grid(adjusted, samples)))
+        print(f"{size[0]}x{size[1]} block={block_size} adjustments: full resolution {reference_time:.3f}s, "
+              f"on the grid {fused_time:.3f}s ({reference_time / fused_time:.1f}x), identical={identical}")
+
+if __name__ == "__main__":
+    main()
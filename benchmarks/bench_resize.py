@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ImageManipulator import ImageManipulator
+from suite import synthetic_image
+
+FACTORS = [1, 2, 3, 4]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        files = []
+        for i in range(16):
+            path = os.path.join(directory, f"{i}.png")
+            synthetic_image(512, seed=i).save(path)
+            files.append(path)
+
+        # Pillow's resize against scale_nearest, which repeats pixels from 3x on
+        image = ImageManipulator.open_image(files[0])
+        for factor in FACTORS[1:]:
+            size = (image.width * factor, image.height * factor)
+            start = time.perf_counter()
+            for _ in range(20):
+                expected = image.resize(size, Image.NEAREST)
+            pillow_time = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(20):
+                scaled = ImageManipulator.scale_nearest(image, factor)
+            fast_time = time.perf_counter() - start
+            assert np.array_equal(np.asarray(scaled), np.asarray(expected))
+            print(f"{factor}x upscale: Pillow {pillow_time / 20 * 1000:.2f} ms, "
+                  f"scale_nearest {fast_time / 20 * 1000:.2f} ms ({pillow_time / fast_time:.2f}x)")
+
+        # One run per factor against every factor from a single decode
+        start = time.perf_counter()
+        for factor in FACTORS:
+            ImageManipulator.resize_images(files, os.path.join(directory, f"single_{factor}"), factor)
+        single_time = time.perf_counter() - start
+        start = time.perf_counter()
+        ImageManipulator.resize_images(files, os.path.join(directory, "multi"), FACTORS)
+        multi_time = time.perf_counter() - start
+        print(f"{len(files)} files at {FACTORS}, {os.cpu_count()} cores: one run per factor {single_time:.2f}s, "
+              f"one multi-scale run {multi_time:.2f}s ({single_time / multi_time:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
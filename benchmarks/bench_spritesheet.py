@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import AtlasPacker
+from ImageManipulator import ImageManipulator
+
+
+def shelf_layout(sizes, max_width=3000, max_height=6000, padding=5):
+    # The original layout: left to right rows, a new row when the next sprite does not fit. Returns the number of
+    # placed sprites and the atlas size.
+    current_x = current_y = max_row_height = total_width = placed = 0
+    for width, height in sizes:
+        if current_x + width > max_width:
+            current_x = 0
+            current_y += max_row_height + padding
+            max_row_height = 0
+        if current_y + height > max_height:
+            break
+        placed += 1
+        current_x += width + padding
+        max_row_height = max(max_row_height, height)
+        total_width = max(total_width, current_x)
+    return placed, (total_width, current_y + max_row_height)
+
+
+def random_sizes(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [(int(width), int(height)) for width, height in rng.integers(8, 64, (count, 2))]
+
+
+def main():
+    for count in (1000, 5000):
+        sizes = random_sizes(count)
+
+        start = time.perf_counter()
+        placed, size = shelf_layout(sizes)
+        shelf_time = time.perf_counter() - start
+        shelf_efficiency = sum(w * h for w, h in sizes[:placed]) / (size[0] * size[1])
+        print(f"{count} sprites, shelf: {placed} placed in {size[0]}x{size[1]}, efficiency {shelf_efficiency:.0%}, "
+              f"{shelf_time:.3f}s")
+
+        for heuristic in AtlasPacker.HEURISTICS:
+            for allow_rotation in (False, True):
+                start = time.perf_counter()
+                placements, size, efficiency = AtlasPacker.pack(sizes, 3000, 6000, 5, heuristic, allow_rotation)
+                elapsed = time.perf_counter() - start
+                print(f"  {heuristic}{' +rotation' if allow_rotation else ''}: "
+                      f"{sum(p is not None for p in placements)} placed in {size[0]}x{size[1]}, "
+                      f"efficiency {efficiency:.0%}, {elapsed:.3f}s")
+
+    # End to end: header-only layout and one decode per sprite
+    with tempfile.TemporaryDirectory() as directory:
+        rng = np.random.default_rng(1)
+        files = []
+        for i, (width, height) in enumerate(random_sizes(2000, 1)):
+            path = os.path.join(directory, f"{i}.png")
+            Image.fromarray(rng.integers(0, 256, (height, width, 4), dtype=np.uint8)).save(path)
+            files.append(path)
+        start = time.perf_counter()
+        result = ImageManipulator.create_spritesheet(files, directory)
+        print(f"create_spritesheet, {len(files)} files: {time.perf_counter() - start:.3f}s, {result.message}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+import PIL
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ImageManipulator import DITHER_MODES, ImageManipulator
+from PaletteCache import PaletteCache
+from PaletteIndex import METRICS, PaletteIndex
+
+# Headless benchmark suite over every ImageManipulator operation:
+#   python benchmarks/suite.py --preset quick --output results.json
+#   python benchmarks/suite.py --preset quick --baseline results.json
+# Inputs are synthetic and seeded, so runs on the same machine are comparable. With --baseline every case that got
+# slower by more than --tolerance is reported and the exit status is 1.
+
+PRESETS = {
+    'quick': {'sizes': [256, 1024], 'block_sizes': [4, 16], 'palette_sizes': [16, 256], 'sprite_counts': [200]},
+    'full': {'sizes': [256, 1024, 2048, 4096, 8192], 'block_sizes': [2, 4, 8, 16, 32],
+             'palette_sizes': [4, 16, 64, 256], 'sprite_counts': [200, 1000, 5000]},
+}
+# Differences below this many seconds are timer noise, never regressions
+NOISE_FLOOR = 0.005
+
+CASES = []
+
+
+def case(name):
+    # A case yields (params, run) pairs, run() is what gets timed. Setup happens in the generator, outside the timing.
+    def register(function):
+        CASES.append((name, function))
+        return function
+    return register
+
+
+def synthetic_image(width, height=None, mode="RGBA", seed=0):
+    # Gradients plus noise with some fully transparent pixels, built in uint8 so 8k images stay cheap to make. Square
+    # unless height is given, the bench_* scripts import it too.
+    height = width if height is None else height
+    rng = np.random.default_rng(seed)
+
+    def ramp(length):
+        # Ramps stop at 231 so the noise never wraps around
+        return (np.arange(length, dtype=np.uint32) * 231 // max(length - 1, 1)).astype(np.uint8)
+
+    x, y = ramp(width), ramp(height)
+    data = np.empty((height, width, 4), dtype=np.uint8)
+    data[:, :, 0] = x[None, :]
+    data[:, :, 1] = y[:, None]
+    data[:, :, 2] = (x[None, :] >> 1) + (y[:, None] >> 1)
+    data[:, :, :3] += rng.integers(0, 24, (height, width, 3), dtype=np.uint8)
+    data[:, :, 3] = np.where(rng.random((height, width), dtype=np.float32) < 0.1, 0, 255)
+    return Image.fromarray(data if mode == "RGBA" else data[:, :, :3])
+
+
+def synthetic_palette(count, seed=0):
+    return [tuple(int(c) for c in color) for color in np.random.default_rng(seed).integers(0, 256, (count, 3))]
+
+
+def save_input(image, directory, name):
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        image.save(path, compress_level=1)
+    return path
+
+
+@case("pixelate")
+def pixelate_case(config):
+    # Warm palette cache, like every image after the first one of a batch
+    for size in config['sizes']:
+        image = synthetic_image(size)
+        for palette_size in config['palette_sizes']:
+            palette = synthetic_palette(palette_size)
+            pixelization = ImageManipulator(PaletteCache())
+            for block_size in config['block_sizes']:
+                pixelization.pixelate(image, block_size, "bench", palette)
+                yield ({'size': size, 'block_size': block_size, 'palette': palette_size},
+                       lambda block_size=block_size: pixelization.pixelate(image, block_size, "bench", palette))
+
+
+@case("dither")
+def dither_case(config):
+    # Every dither mode against the undithered match, on a small palette where banding shows
+    palette = synthetic_palette(4)
+    for size in config['sizes']:
+        image = synthetic_image(size)
+        pixelization = ImageManipulator(PaletteCache())
+        for dither in DITHER_MODES:
+            pixelization.pixelate(image, 4, "bench", palette, dither=dither)
+            yield ({'size': size, 'dither': dither},
+                   lambda dither=dither: pixelization.pixelate(image, 4, "bench", palette, dither=dither))
+
+
+@case("palette_index")
+def palette_index_case(config):
+    for palette_size in config['palette_sizes']:
+        palette = synthetic_palette(palette_size)
+        yield {'palette': palette_size}, lambda: PaletteIndex(palette)
+
+
+@case("closest_color")
+def closest_color_case(config):
+    # The scalar per-color match, 1000 colors per run
+    colors = [tuple(int(c) for c in color) for color in np.random.default_rng(1).integers(0, 256, (1000, 3))]
+    for palette_size in config['palette_sizes']:
+        palette = synthetic_palette(palette_size)
+        yield {'palette': palette_size}, lambda: [ImageManipulator.closest_color(color, palette) for color in colors]
+
+
+@case("match_blocks")
+def match_blocks_case(config):
+    # The vectorized match of block averages, 65536 RGBA blocks per run
+    colors = np.random.default_rng(1).integers(0, 256, (65536, 4))
+    for palette_size in config['palette_sizes']:
+        palette_index = PaletteIndex(synthetic_palette(palette_size))
+        yield {'palette': palette_size}, lambda: ImageManipulator.match_blocks(colors, palette_index)
+
+
+@case("metric_match")
+def metric_match_case(config):
+    # 4096 distinct colors against a fresh index of every metric: the LUT build for rgb, the table fill for the others
+    colors = np.random.default_rng(1).integers(0, 256, (4096, 3))
+    for palette_size in config['palette_sizes']:
+        palette = synthetic_palette(palette_size)
+        for metric in METRICS:
+            yield ({'palette': palette_size, 'metric': metric},
+                   lambda palette=palette, metric=metric: PaletteIndex(palette, metric=metric).match(colors))
+
+
+@case("replace_colors")
+def replace_colors_case(config):
+    color_map = {(0, 0, 0): (255, 0, 0), (128, 128, 128): (0, 0, 255), (255, 255, 255): (0, 255, 0)}
+    for size in config['sizes']:
+        path = save_input(synthetic_image(size), config['directory'], f"replace_{size}.png")
+        yield {'size': size}, lambda path=path: ImageManipulator.replace_colors([path], config['directory'], color_map)
+
+
+@case("remove_color")
+def remove_color_case(config):
+    for size in config['sizes']:
+        image = synthetic_image(size)
+        yield {'size': size}, lambda image=image: ImageManipulator.remove_color(image, (128, 128, 128))
+
+
+@case("remove_img_background")
+def remove_background_case(config):
+    for size in config['sizes']:
+        image = synthetic_image(size)
+        for mode in ("most_common", "border"):
+            yield ({'size': size, 'mode': mode},
+                   lambda image=image, mode=mode: ImageManipulator.remove_img_background(image, mode))
+
+
+@case("adjust")
+def adjust_case(config):
+    # The full-resolution adjustments and the fused LUT version pixelate applies on the block grid
+    for size in config['sizes']:
+        image = synthetic_image(size)
+        yield {'size': size, 'op': "saturation"}, lambda image=image: ImageManipulator.adjust_saturation(image, 30)
+        yield {'size': size, 'op': "brightness"}, lambda image=image: ImageManipulator.adjust_brightness(image, 20)
+        yield {'size': size, 'op': "contrast"}, lambda image=image: ImageManipulator.adjust_contrast(image, 40)
+        yield {'size': size, 'op': "grid"}, lambda image=image: ImageManipulator.adjust_grid(image, 30, 20, 40)
+
+
+@case("resize_images")
+def resize_case(config):
+    for size in config['sizes']:
+        path = save_input(synthetic_image(size), config['directory'], f"resize_{size}.png")
+        yield {'size': size}, lambda path=path: ImageManipulator.resize_images([path], config['directory'], 2)
+
+
+@case("create_spritesheet")
+def spritesheet_case(config):
+    rng = np.random.default_rng(2)
+    for count in config['sprite_counts']:
+        directory = os.path.join(config['directory'], f"sprites_{count}")
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for i, (width, height) in enumerate(rng.integers(8, 64, (count, 2))):
+            image = Image.fromarray(rng.integers(0, 256, (height, width, 4), dtype=np.uint8))
+            files.append(save_input(image, directory, f"{i}.png"))
+        yield {'sprites': count}, lambda files=files, directory=directory: \
+            ImageManipulator.create_spritesheet(files, directory)
+
+
+def case_id(name, params):
+    return name + "[" + ",".join(f"{key}={value}" for key, value in params.items()) + "]"
+
+
+def run(config, repeat, selected=None, log=print):
+    results = {}
+    for name, generate in CASES:
+        if selected and not any(pattern in name for pattern in selected):
+            continue
+        for params, function in generate(config):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                function()
+                timings.append(time.perf_counter() - start)
+            key = case_id(name, params)
+            results[key] = {'case': name, 'params': params, 'min': min(timings),
+                            'median': statistics.median(timings), 'runs': len(timings)}
+            log(f"{key}: {results[key]['median'] * 1000:.2f} ms")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Returns (key, baseline median, median, ratio) of every case that got slower by more than tolerance
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        ratio = result['median'] / reference['median'] if reference['median'] else float("inf")
+        if ratio > 1 + tolerance and result['median'] - reference['median'] > NOISE_FLOOR:
+            regressions.append((key, reference['median'], result['median'], ratio))
+    return regressions
+
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pillow': PIL.__version__,
+            'machine': platform.machine(), 'system': platform.system(), 'cpus': os.cpu_count()}
+
+
+def parse_sizes(value):
+    return [int(item) for item in value.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every ImageManipulator operation")
+    parser.add_argument("--preset", choices=PRESETS, default="quick")
+    parser.add_argument("--sizes", type=parse_sizes, help="Square image sizes, e.g. 256,1024")
+    parser.add_argument("--block-sizes", dest="block_sizes", type=parse_sizes)
+    parser.add_argument("--palette-sizes", dest="palette_sizes", type=parse_sizes)
+    parser.add_argument("--sprite-counts", dest="sprite_counts", type=parse_sizes)
+    parser.add_argument("--case", dest="cases", action="append", help="Only run cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case, the median is compared")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown, 0.25 = 25%%")
+    args = parser.parse_args(argv)
+
+    config = dict(PRESETS[args.preset])
+    for key in ('sizes', 'block_sizes', 'palette_sizes', 'sprite_counts'):
+        if getattr(args, key):
+            config[key] = getattr(args, key)
+
+    with tempfile.TemporaryDirectory() as directory:
+        config['directory'] = directory
+        results = run(config, args.repeat, args.cases)
+
+    report = {'environment': environment(), 'preset': args.preset, 'repeat': args.repeat, 'results': results}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline['environment'] != report['environment']:
+            print("Warning: the baseline was recorded in a different environment")
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for key, reference, median, ratio in regressions:
+            print(f"REGRESSION {key}: {reference * 1000:.2f} ms -> {median * 1000:.2f} ms ({ratio:.2f}x)")
+        print(f"{len(regressions)} regressions in {len(set(results) & set(baseline['results']))} compared cases")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import sys
+from AtlasPacker import HEURISTICS, SORT_ORDERS
+from Functions import CACHE_DIR, PALETTES, get_palette
+from ImageManipulator import BACKGROUND_MODES, DITHER_MODES, OUTPUT_FORMATS, ImageManipulator
+from JobRunner import DEFAULT_SETTINGS, JobRunner, load_job, parse_color, validate_settings
+from PaletteCache import PaletteCache
+from PaletteIndex import METRICS
+from ParallelPixelator import ParallelPixelator
+from Recorder import Recorder
+
+# Headless entry point: python -m cli <operation> FILES... [options]
+# Prints the OperationResult as JSON and exits non-zero if any file failed.
+
+
+def color_argument(value):
+    # "R,G,B" or "#RRGGBB", read like the colors of job files
+    try:
+        return parse_color(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_mapping(value):
+    # Accepts "SOURCE=TARGET" with both colors as color_argument reads them
+    source, separator, target = value.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError(f"invalid mapping: {value!r}")
+    return color_argument(source), color_argument(target)
+
+
+def load_settings(args):
+    # Settings JSON from PixelateWindow.export_settings, overridden by any flag given on the command line
+    settings = dict(DEFAULT_SETTINGS)
+    if args.settings:
+        with open(args.settings, 'r') as json_file:
+            settings.update(json.load(json_file))
+    for key in ('block_size', 'saturation', 'brightness', 'contrast', 'palette', 'background', 'background_mode',
+                'output_format', 'compress_level', 'optimize', 'metric', 'dither'):
+        value = getattr(args, key)
+        if value is not None:
+            settings[key] = value
+    return settings
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Pixel Image Manipulator without the GUI.")
+    subparsers = parser.add_subparsers(dest="operation", required=True)
+
+    def add_operation(name, help_text):
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument("files", nargs="+", help="PNG images to process")
+        subparser.add_argument("-o", "--output", help="Output directory (default: directory of the first file)")
+        return subparser
+
+    def add_incremental(subparser):
+        subparser.add_argument("--incremental", action="store_true",
+                               help="Skip files whose content and settings match the output directory's manifest, "
+                                    "remove outputs of deleted inputs")
+
+    def add_memory_budget(subparser):
+        subparser.add_argument("--memory-budget", dest="memory_budget", type=float, metavar="MB",
+                               help="Process images larger than this in streamed strips (default: 256)")
+
+    def add_cache_dir(subparser):
+        subparser.add_argument("--cache-dir", dest="cache_dir", default=CACHE_DIR, metavar="DIR",
+                               help=f"Palette lookup tables persisted between runs, \"\" keeps them in memory only "
+                                    f"(default: {CACHE_DIR})")
+
+    resize = add_operation("resize", "Resize images by a percentage")
+    resize.add_argument("-p", "--percent", type=float, nargs="+", required=True,
+                        help="Resize percentage, e.g. 200; several, e.g. 100 200 300, go to resized_images/<factor>x")
+    add_incremental(resize)
+
+    spritesheet = add_operation("spritesheet", "Combine images into a spritesheet")
+    spritesheet.add_argument("--rotate", action="store_true", help="Allow sprites to be rotated by 90 degrees")
+    spritesheet.add_argument("--heuristic", choices=HEURISTICS, default="bottom_left", help="Free space choice")
+    spritesheet.add_argument("--sort", choices=SORT_ORDERS, default="max_side", help="Order sprites are packed in")
+    spritesheet.add_argument("--trim", action="store_true", help="Crop transparent borders off every sprite")
+    spritesheet.add_argument("--dedupe", action="store_true", help="Pack identical sprites once")
+
+    replace = add_operation("replace", "Replace colors")
+    replace.add_argument("--target", type=color_argument, help="Color to replace, R,G,B or #RRGGBB")
+    replace.add_argument("--new", type=color_argument, help="New color, R,G,B or #RRGGBB")
+    replace.add_argument("--map", dest="color_map", type=parse_mapping, action="append", default=[],
+                         metavar="SOURCE=TARGET", help="Another replacement, can be repeated; all run in one pass")
+
+    remove = add_operation("remove", "Turn a color transparent")
+    remove.add_argument("--color", type=color_argument, required=True, help="Color to remove, R,G,B or #RRGGBB")
+    add_memory_budget(replace)
+    add_memory_budget(remove)
+
+    pixelate = subparsers.add_parser("pixelate", help="Pixelate images with a palette")
+    pixelate.add_argument("files", nargs="+", help="PNG images to process")
+    pixelate.add_argument("--settings", help="Settings JSON exported from the Pixelate window")
+    pixelate.add_argument("--block-size", dest="block_size", type=int)
+    pixelate.add_argument("--saturation", type=int)
+    pixelate.add_argument("--brightness", type=int)
+    pixelate.add_argument("--contrast", type=int)
+    pixelate.add_argument("--palette", choices=[palette["name"] for palette in PALETTES], metavar="NAME")
+    pixelate.add_argument("--background", dest="background", action="store_const", const=1,
+                          help="Remove the most common color first")
+    pixelate.add_argument("--no-background", dest="background", action="store_const", const=0)
+    pixelate.add_argument("--background-mode", dest="background_mode", choices=BACKGROUND_MODES,
+                          help="most_common clears that color everywhere, border only where it touches the border")
+    pixelate.add_argument("--output-format", dest="output_format", choices=OUTPUT_FORMATS,
+                          help="indexed writes palette PNGs, far smaller and faster to encode")
+    pixelate.add_argument("--compress-level", dest="compress_level", type=int, choices=range(10), metavar="0-9",
+                          help="zlib level, 0 is the fastest encode and 9 the smallest file (default: 6)")
+    pixelate.add_argument("--optimize", action="store_const", const=True,
+                          help="Let the PNG encoder search for the smallest file, slower")
+    pixelate.add_argument("--metric", choices=METRICS,
+                          help="Color distance for palette matching, cie76 and ciede2000 are perceptual (default: rgb)")
+    pixelate.add_argument("--dither", choices=DITHER_MODES,
+                          help="Dither the block grid against the palette, ordered (bayer) or error diffusion")
+    pixelate.add_argument("-j", "--workers", type=int, help="Worker processes (default: all cores)")
+    pixelate.add_argument("--metrics", metavar="PATH",
+                          help="Write per-file stage timings and counters as JSON lines, totals on the last line")
+    add_memory_budget(pixelate)
+    add_incremental(pixelate)
+    add_cache_dir(pixelate)
+
+    job = add_operation("job", "Run a chain of operations from a job file, decoding and encoding every image once")
+    job.add_argument("--job", dest="job_file", required=True, help="Job JSON, or a Pixelate window settings JSON")
+    add_incremental(job)
+    add_cache_dir(job)
+    return parser
+
+
+def run(args):
+    files = list(args.files)
+    output_directory = getattr(args, "output", None) or os.path.dirname(os.path.abspath(files[0]))
+    if getattr(args, "output", None):
+        os.makedirs(output_directory, exist_ok=True)
+    memory_budget = int(args.memory_budget * 1024 * 1024) if getattr(args, "memory_budget", None) else None
+
+    if args.operation == "resize":
+        factors = [percent / 100.0 for percent in args.percent]
+        return ImageManipulator.resize_images(files, output_directory, factors[0] if len(factors) == 1 else factors,
+                                              args.incremental)
+    if args.operation == "spritesheet":
+        return ImageManipulator.create_spritesheet(files, output_directory, args.rotate, args.heuristic, args.sort,
+                                                   args.trim, args.dedupe)
+    if args.operation == "replace":
+        color_map = dict(args.color_map)
+        if (args.target is None) != (args.new is None):
+            raise SystemExit("--target and --new must be given together")
+        if args.target is not None:
+            color_map[args.target] = args.new
+        if not color_map:
+            raise SystemExit("Nothing to replace, give --target/--new or --map")
+        return ImageManipulator.replace_colors(files, output_directory, color_map, memory_budget)
+    if args.operation == "remove":
+        return ImageManipulator.remove_color_images(files, output_directory, args.color, memory_budget)
+    if args.operation == "job":
+        try:
+            job = load_job(args.job_file)
+        except ValueError as e:
+            raise SystemExit(f"Invalid job file: {e}")
+        return JobRunner(PaletteCache(args.cache_dir)).run(job, files, output_directory, args.incremental)
+
+    try:
+        settings = validate_settings(load_settings(args))
+    except ValueError as e:
+        raise SystemExit(f"Invalid settings: {e}")
+    palette = get_palette(settings['palette'])
+    recorder = Recorder() if args.metrics else None
+    pixelator = ParallelPixelator(workers=args.workers, palette_cache=PaletteCache(args.cache_dir),
+                                  memory_budget=memory_budget)
+    result = pixelator.run(files, settings, palette, recorder=recorder, incremental=args.incremental)
+    if recorder is not None:
+        recorder.write_jsonl(args.metrics)
+    return result
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    result = run(args)
+    json.dump(result.to_dict(), sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0 if result.ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
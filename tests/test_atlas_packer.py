@@ -0,0 +1,115 @@
+import json
+import os
+import sys
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import AtlasPacker
+from AtlasPacker import HEURISTICS, SORT_ORDERS, MaxRectsPacker, pack_pages
+from ImageManipulator import ImageManipulator
+
+
+def random_sizes(count, seed, largest=64):
+    rng = np.random.default_rng(seed)
+    return [(int(width), int(height)) for width, height in rng.integers(1, largest, (count, 2))]
+
+
+def placed_rects(sizes, indices, placements, padding=0):
+    # (x, y, width, height) every placement covers in the atlas, padding included
+    rects = []
+    for i, (x, y, rotated) in zip(indices, placements):
+        width, height = sizes[i]
+        if rotated:
+            width, height = height, width
+        rects.append((x, y, width + padding, height + padding))
+    return rects
+
+
+def assert_disjoint(rects):
+    rects = np.array(rects)
+    x, y, right, bottom = rects[:, 0], rects[:, 1], rects[:, 0] + rects[:, 2], rects[:, 1] + rects[:, 3]
+    overlap = (x[:, None] < right[None, :]) & (x[None, :] < right[:, None]) & \
+        (y[:, None] < bottom[None, :]) & (y[None, :] < bottom[:, None])
+    np.fill_diagonal(overlap, False)
+    assert not overlap.any()
+
+
+@pytest.mark.parametrize("heuristic", HEURISTICS)
+@pytest.mark.parametrize("allow_rotation", [False, True])
+@pytest.mark.parametrize("sort", SORT_ORDERS)
+def test_pages_hold_every_sprite_once_without_overlap(heuristic, allow_rotation, sort):
+    sizes = random_sizes(150, seed=len(heuristic) + len(sort)) + [(300, 20), (20, 300), (90, 90)]
+    max_width, max_height, padding = 256, 320, 2
+    pages, oversized = pack_pages(sizes, max_width, max_height, padding, heuristic, allow_rotation, sort)
+
+    # (300, 20) only fits turned, (20, 300) fits as it is
+    assert oversized == ([] if allow_rotation else [len(sizes) - 3])
+    packed = sorted(i for indices, _, _, _ in pages for i in indices)
+    assert packed == sorted(set(range(len(sizes))) - set(oversized))
+
+    for indices, placements, (atlas_width, atlas_height), efficiency in pages:
+        assert atlas_width <= max_width and atlas_height <= max_height
+        assert 0 < efficiency <= 1
+        for i, (x, y, rotated) in zip(indices, placements):
+            assert allow_rotation or not rotated
+            assert not (rotated and sizes[i][0] == sizes[i][1])
+        for x, y, width, height in placed_rects(sizes, indices, placements):
+            assert x >= 0 and y >= 0 and x + width <= atlas_width and y + height <= atlas_height
+        # Sprites keep the padding between each other
+        assert_disjoint(placed_rects(sizes, indices, placements, padding))
+
+
+@pytest.mark.parametrize("heuristic", HEURISTICS)
+def test_free_rects_never_cover_placements(heuristic):
+    packer = MaxRectsPacker(128, 128, heuristic, allow_rotation=True)
+    placed = []
+    for width, height in random_sizes(80, seed=3, largest=40):
+        placement = packer.insert(width, height)
+        if placement is None:
+            continue
+        x, y, rotated = placement
+        placed.append((x, y, height, width) if rotated else (x, y, width, height))
+        assert_disjoint(placed)
+        for free in packer.free:
+            assert_disjoint([tuple(free)] + [placed[-1]])
+            assert free[0] >= 0 and free[1] >= 0 and free[0] + free[2] <= 128 and free[1] + free[3] <= 128
+
+
+def test_rotated_frames_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    files = []
+    # Tall sprites beside a wide one that only fits the 3000 wide page turned, so some frames get rotated
+    for i, (width, height) in enumerate([(2990, 40), (30, 70), (50, 20), (12, 90), (64, 64)]):
+        path = str(tmp_path / f"sprite{i}.png")
+        Image.fromarray(rng.integers(0, 256, (height, width, 4), dtype=np.uint8)).save(path)
+        files.append(path)
+    output_directory = tmp_path / "out"
+    output_directory.mkdir()
+    result = ImageManipulator.create_spritesheet(files, str(output_directory), allow_rotation=True)
+    assert result.ok
+
+    rotated_frames = 0
+    for metadata_path in output_directory.glob("*.json"):
+        metadata = json.loads(metadata_path.read_text())
+        atlas = Image.open(metadata_path.with_suffix(".png"))
+        for name, frame in metadata['frames'].items():
+            x, y, width, height = (frame['frame'][key] for key in ("x", "y", "w", "h"))
+            if frame['rotated']:
+                # Loaders cut height x width pixels and turn them back counterclockwise
+                region = atlas.crop((x, y, x + height, y + width)).transpose(Image.Transpose.ROTATE_90)
+                rotated_frames += 1
+            else:
+                region = atlas.crop((x, y, x + width, y + height))
+            source = Image.open(tmp_path / name).convert("RGBA")
+            assert region.size == source.size
+            assert np.array_equal(np.asarray(region), np.asarray(source))
+    assert rotated_frames
+
+
+def test_unknown_options():
+    with pytest.raises(ValueError):
+        MaxRectsPacker(16, 16, "top_right")
+    with pytest.raises(ValueError):
+        AtlasPacker.sort_sizes([(1, 1)], "color")
@@ -0,0 +1,134 @@
+import json
+import os
+import sys
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from BuildManifest import BuildManifest, run_incremental
+from ImageManipulator import ImageManipulator, OperationResult
+
+
+class CopyRun:
+    # Stands in for an operation: "processes" files by copying them to out/, remembers which files it was given and
+    # fails the files listed in failing
+    def __init__(self, directory):
+        self.directory = directory
+        self.calls = []
+        self.failing = set()
+
+    def output_path(self, file):
+        return os.path.join(self.directory, "out", os.path.basename(file))
+
+    def __call__(self, files):
+        self.calls.append(sorted(os.path.basename(file) for file in files))
+        os.makedirs(os.path.join(self.directory, "out"), exist_ok=True)
+        result = OperationResult("copy", files, os.path.join(self.directory, "out"), "Copied.")
+        for file in files:
+            if file in self.failing:
+                result.add_failure(file, OSError("failed"))
+                continue
+            with open(file, "rb") as source, open(self.output_path(file), "wb") as output:
+                output.write(source.read())
+            result.outputs.append(self.output_path(file))
+        return result
+
+    def incremental(self, files, settings):
+        return run_incremental(files, self.output_path, settings, self)
+
+
+def make_inputs(directory, count=3):
+    files = []
+    for i in range(count):
+        path = os.path.join(directory, f"{i}.bin")
+        with open(path, "wb") as file:
+            file.write(bytes([i]) * 100)
+        files.append(path)
+    return files
+
+
+def test_skips_unchanged_and_redoes_changed_files(tmp_path):
+    files = make_inputs(str(tmp_path))
+    run = CopyRun(str(tmp_path))
+    result = run.incremental(files, {'level': 1})
+    assert run.calls[-1] == ["0.bin", "1.bin", "2.bin"]
+    assert result.outputs == [run.output_path(file) for file in files]
+
+    result = run.incremental(files, {'level': 1})
+    assert run.calls[-1] == []
+    # Skipped files still count as outputs of the run
+    assert result.outputs == [run.output_path(file) for file in files]
+    assert "3 unchanged files skipped" in result.message
+
+    # New content of the same size is noticed, a touched but identical file is not redone
+    with open(files[1], "wb") as file:
+        file.write(b"\xff" * 100)
+    # Explicit times, so a coarse file system clock cannot hide the rewrite
+    os.utime(files[1], ns=(2, 2))
+    os.utime(files[2], ns=(1, 1))
+    run.incremental(files, {'level': 1})
+    assert run.calls[-1] == ["1.bin"]
+    run.incremental(files, {'level': 1})
+    assert run.calls[-1] == []
+
+
+def test_settings_change_redoes_every_file(tmp_path):
+    files = make_inputs(str(tmp_path))
+    run = CopyRun(str(tmp_path))
+    run.incremental(files, {'level': 1, 'palette': [[0, 0, 0]]})
+    run.incremental(files, {'palette': [[0, 0, 0]], 'level': 1})
+    assert run.calls[-1] == []
+    run.incremental(files, {'level': 1, 'palette': [[0, 0, 1]]})
+    assert run.calls[-1] == ["0.bin", "1.bin", "2.bin"]
+
+
+def test_deleted_inputs_and_outputs(tmp_path):
+    files = make_inputs(str(tmp_path))
+    run = CopyRun(str(tmp_path))
+    run.incremental(files, {})
+
+    os.remove(files[0])
+    os.remove(run.output_path(files[1]))
+    result = run.incremental(files[1:], {})
+    # A missing output is rebuilt, the output of a deleted input is removed with its manifest entry
+    assert run.calls[-1] == ["1.bin"]
+    assert not os.path.exists(run.output_path(files[0]))
+    assert "1 stale output removed" in result.message
+    with open(tmp_path / "out" / BuildManifest.FILE_NAME) as file:
+        assert sorted(json.load(file)['entries']) == ["1.bin", "2.bin"]
+
+
+def test_failed_files_are_retried(tmp_path):
+    files = make_inputs(str(tmp_path))
+    run = CopyRun(str(tmp_path))
+    run.failing = {files[2]}
+    result = run.incremental(files, {})
+    assert result.failed and run.output_path(files[2]) not in result.outputs
+    run.failing = set()
+    run.incremental(files, {})
+    assert run.calls[-1] == ["2.bin"]
+
+
+def test_unreadable_manifest_redoes_everything(tmp_path):
+    files = make_inputs(str(tmp_path))
+    run = CopyRun(str(tmp_path))
+    run.incremental(files, {})
+    (tmp_path / "out" / BuildManifest.FILE_NAME).write_text("{not json")
+    run.incremental(files, {})
+    assert run.calls[-1] == ["0.bin", "1.bin", "2.bin"]
+
+
+def test_multi_scale_resize(tmp_path):
+    # A file with several outputs is skipped only while all of them are up to date
+    files = []
+    for i in range(2):
+        path = str(tmp_path / f"{i}.png")
+        Image.fromarray(np.full((4, 5, 4), i * 100, dtype=np.uint8)).save(path)
+        files.append(path)
+    first = ImageManipulator.resize_images(files, str(tmp_path), [1, 2], incremental=True)
+    assert len(first.outputs) == 4
+    os.remove(tmp_path / "resized_images" / "2x" / "1.png")
+    second = ImageManipulator.resize_images(files, str(tmp_path), [1, 2], incremental=True)
+    assert "1 unchanged file skipped" in second.message
+    assert sorted(second.outputs) == sorted(first.outputs)
+    assert Image.open(tmp_path / "resized_images" / "2x" / "1.png").size == (10, 8)
@@ -0,0 +1,91 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ImageManipulator import DITHER_MODES, ERROR_KERNELS, ImageManipulator
+from PaletteIndex import PaletteIndex
+
+PALETTE = [(0, 0, 0), (255, 255, 255), (200, 40, 40), (40, 160, 60), (30, 60, 200)]
+
+
+def sequential_diffusion(rgb, opaque, palette_index, kernel):
+    # Textbook error diffusion: cells in raster order, each one matched and its error pushed to its neighbours. Error
+    # pushed past the sides is dropped, error pushed below the last row is returned as the carry.
+    height, width, _ = rgb.shape
+    buffer = np.zeros((height + 2, width, 3), dtype=np.float32)
+    buffer[:height] = rgb
+    palette = palette_index.palette.astype(np.float32)
+    indices = np.zeros((height, width), dtype=np.intp)
+    for y in range(height):
+        for x in range(width):
+            if not opaque[y, x]:
+                continue
+            value = np.clip(buffer[y, x], 0, 255)
+            indices[y, x] = palette_index.nearest(np.rint(value).astype(np.uint8)[None])[0]
+            error = value - palette[indices[y, x]]
+            for dx, dy, weight in kernel:
+                if 0 <= x + dx < width:
+                    buffer[y + dy, x + dx] += error * np.float32(weight)
+    return indices, buffer[height:]
+
+
+def random_grid(height, width, seed, transparent=0.0):
+    rng = np.random.default_rng(seed)
+    grid = rng.integers(0, 256, (height, width, 4)).astype(np.uint8)
+    grid[:, :, 3] = np.where(rng.random((height, width)) < transparent, 0, 255)
+    return grid
+
+
+@pytest.mark.parametrize("dither", ["floyd_steinberg", "atkinson"])
+@pytest.mark.parametrize("size", [(1, 1), (1, 9), (9, 1), (7, 11), (16, 5)])
+@pytest.mark.parametrize("transparent", [0.0, 0.3])
+def test_wavefront_matches_sequential_reference(dither, size, transparent):
+    grid = random_grid(*size, seed=size[0] * 31 + size[1], transparent=transparent)
+    opaque = grid[:, :, 3] != 0
+    rgb = grid[:, :, :3].astype(np.float32)
+    palette_index = PaletteIndex(PALETTE)
+    indices, _, carry = ImageManipulator.diffuse_errors(rgb, opaque, palette_index, ERROR_KERNELS[dither])
+    expected, expected_carry = sequential_diffusion(rgb, opaque, palette_index, ERROR_KERNELS[dither])
+    assert np.array_equal(indices[opaque], expected[opaque])
+    assert np.allclose(carry[:, 2:size[1] + 2], expected_carry, atol=1e-3)
+
+
+@pytest.mark.parametrize("dither", DITHER_MODES[1:])
+def test_strips_match_whole_grid(dither):
+    # Row offsets and the carried error make a grid dithered strip by strip come out the same as in one go
+    grid = random_grid(21, 13, seed=5, transparent=0.1)
+    palette_index = PaletteIndex(PALETTE)
+    whole, _, _ = ImageManipulator.dither_blocks(grid, palette_index, dither)
+    strips, carry = [], None
+    for top in range(0, 21, 6):
+        colors, _, carry = ImageManipulator.dither_blocks(grid[top:top + 6], palette_index, dither, top, carry)
+        strips.append(colors)
+    assert np.array_equal(np.concatenate(strips), whole)
+
+
+@pytest.mark.parametrize("dither", DITHER_MODES[1:])
+def test_only_palette_colors_and_transparency_kept(dither):
+    grid = random_grid(12, 12, seed=9, transparent=0.25)
+    colors, _, _ = ImageManipulator.dither_blocks(grid, PaletteIndex(PALETTE), dither)
+    opaque = grid[:, :, 3] != 0
+    assert np.array_equal(colors[~opaque], grid[~opaque])
+    assert (colors[opaque, 3] == 255).all()
+    assert set(map(tuple, colors[opaque, :3])) <= set(PALETTE)
+
+
+def test_flat_gray_mixes_black_and_white():
+    # Error diffusion of mid gray against black and white alternates the two instead of snapping to one
+    grid = np.full((8, 8, 3), 128, dtype=np.uint8)
+    colors, _, _ = ImageManipulator.dither_blocks(grid, PaletteIndex([(0, 0, 0), (255, 255, 255)]), "floyd_steinberg")
+    white = (colors[:, :, 0] == 255).mean()
+    assert 0.4 <= white <= 0.6
+
+
+def test_bayer_matrix():
+    for size in (2, 4, 8):
+        matrix = ImageManipulator.bayer_matrix(size)
+        assert matrix.shape == (size, size)
+        # Every threshold once, evenly spaced inside (-0.5, 0.5)
+        assert np.allclose(np.sort(matrix.ravel()), (np.arange(size * size) + 0.5) / (size * size) - 0.5)
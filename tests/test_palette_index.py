@@ -0,0 +1,79 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PaletteIndex import METRICS, PaletteIndex, ciede2000, rgb_to_lab
+
+# (L, a, b) pairs and Delta E 2000 from the test data of Sharma, Wu and Dalal
+SHARMA_PAIRS = [((50.0, 2.6772, -79.7751), (50.0, 0.0, -82.7485), 2.0425),
+                ((50.0, 0.0, 0.0), (50.0, -1.0, 2.0), 2.3669),
+                ((50.0, 2.5, 0.0), (73.0, 25.0, -18.0), 27.1492),
+                ((50.0, 2.5, 0.0), (50.0, 3.1736, 0.5854), 1.0000),
+                ((60.2574, -34.0099, 36.2677), (60.4626, -34.1751, 39.4387), 1.2644)]
+
+
+def brute_force_distance(color, entry, metric):
+    # One pair at a time, written out from the definitions
+    r1, g1, b1 = (int(c) for c in color)
+    r2, g2, b2 = (int(c) for c in entry)
+    if metric == "rgb":
+        return (r1 - r2) ** 2 + (g1 - g2) ** 2 + (b1 - b2) ** 2
+    if metric == "weighted_rgb":
+        red_mean = (r1 + r2) // 2
+        return ((512 + red_mean) * (r1 - r2) ** 2 >> 8) + 4 * (g1 - g2) ** 2 + ((767 - red_mean) * (b1 - b2) ** 2 >> 8)
+    lab1, lab2 = rgb_to_lab(np.array(color)), rgb_to_lab(np.array(entry))
+    if metric == "cie76":
+        return float(((lab1 - lab2) ** 2).sum())
+    return float(ciede2000(lab1, lab2))
+
+
+def random_colors(count, seed):
+    rng = np.random.default_rng(seed)
+    # Random colors plus the corners and near-gray colors, where LUT cells tie most often
+    gray = np.repeat(rng.integers(0, 256, (count // 4, 1)), 3, axis=1) + rng.integers(-2, 3, (count // 4, 3))
+    corners = np.array([[r, g, b] for r in (0, 255) for g in (0, 255) for b in (0, 255)])
+    return np.clip(np.concatenate([rng.integers(0, 256, (count, 3)), gray, corners]), 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("metric", METRICS)
+@pytest.mark.parametrize("palette_size", [1, 2, 16, 64])
+def test_matches_brute_force(metric, palette_size):
+    palette = [tuple(c) for c in np.random.default_rng(palette_size).integers(0, 256, (palette_size, 3))]
+    colors = random_colors(300, seed=palette_size)
+    palette_index = PaletteIndex(palette, metric=metric)
+    # The second match reads the filled table or LUT again instead of measuring
+    for _ in range(2):
+        indices, _ = palette_index.match(colors)
+        for color, index in zip(colors, indices):
+            distances = [brute_force_distance(color, entry, metric) for entry in palette]
+            assert distances[index] == pytest.approx(min(distances), abs=1e-9)
+
+
+@pytest.mark.parametrize("bits", [3, 5, 6])
+def test_lut_resolution_does_not_change_matches(bits):
+    palette = [tuple(c) for c in np.random.default_rng(7).integers(0, 256, (24, 3))]
+    colors = random_colors(2000, seed=bits)
+    palette_index = PaletteIndex(palette, bits=bits)
+    indices, refined = palette_index.match(colors)
+    assert np.array_equal(indices, palette_index.nearest(colors))
+    assert 0 <= refined <= len(colors)
+
+
+@pytest.mark.parametrize("metric", METRICS)
+def test_duplicate_palette_colors_resolve_to_the_first(metric):
+    palette = [(10, 200, 30), (250, 250, 250), (10, 200, 30)]
+    indices, _ = PaletteIndex(palette, metric=metric).match(np.array([[12, 198, 33], [10, 200, 30]]))
+    assert list(indices) == [0, 0]
+
+
+def test_ciede2000_reference_pairs():
+    for lab1, lab2, expected in SHARMA_PAIRS:
+        assert float(ciede2000(np.array(lab1), np.array(lab2))) == pytest.approx(expected, abs=1e-3)
+        assert float(ciede2000(np.array(lab2), np.array(lab1))) == pytest.approx(expected, abs=1e-3)
+
+
+def test_unknown_metric():
+    with pytest.raises(ValueError):
+        PaletteIndex([(0, 0, 0)], metric="hsv")
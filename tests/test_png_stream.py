@@ -0,0 +1,164 @@
+import os
+import struct
+import sys
+import zlib
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import PngStream
+from PngStream import PngStripReader, PngStripWriter, rewrite_palette
+
+# Odd widths leave packed rows half filled and make the filters wrap at uneven byte offsets
+SIZES = [(1, 1), (13, 9), (31, 17)]
+MODES = ["L", "LA", "RGB", "RGBA"]
+
+
+def random_image(mode, size, seed=0):
+    rng = np.random.default_rng(seed)
+    width, height = size
+    if mode == "P":
+        image = Image.fromarray(rng.integers(0, 16, (height, width), dtype=np.uint8), "P")
+        image.putpalette(rng.integers(0, 256, 16 * 3, dtype=np.uint8).tobytes())
+        return image
+    channels = len(mode)
+    pixels = rng.integers(0, 256, (height, width, channels), dtype=np.uint8)
+    return Image.fromarray(pixels[:, :, 0] if channels == 1 else pixels, mode)
+
+
+def read_strips(path, rows):
+    with PngStripReader(path) as reader:
+        return np.concatenate([np.asarray(strip) for _, strip in reader.strips(rows)])
+
+
+def paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    return a if pa <= pb and pa <= pc else b if pb <= pc else c
+
+
+def filtered_png(path, pixels, color_type):
+    # Encodes 8-bit pixels with every row using the next of the five filter types, which PIL's encoder never mixes
+    rows = pixels.reshape(pixels.shape[0], -1).astype(np.int32)
+    distance = PngStream.CHANNELS[color_type]
+    scanlines = bytearray()
+    previous = np.zeros(rows.shape[1], dtype=np.int32)
+    for y, row in enumerate(rows):
+        filter_type = y % 5
+        filtered = []
+        for i, value in enumerate(row):
+            a = row[i - distance] if i >= distance else 0
+            b = previous[i]
+            c = previous[i - distance] if i >= distance else 0
+            predictor = (0, a, b, (a + b) // 2, paeth(a, b, c))[filter_type]
+            filtered.append((value - predictor) % 256)
+        scanlines += bytes([filter_type] + filtered)
+        previous = row
+    header = struct.pack(">IIBBBBB", pixels.shape[1], pixels.shape[0], 8, color_type, 0, 0, 0)
+    with open(path, "wb") as file:
+        file.write(PngStream.PNG_SIGNATURE + PngStream._chunk(b"IHDR", header) +
+                   PngStream._chunk(b"IDAT", zlib.compress(bytes(scanlines))) + PngStream._chunk(b"IEND", b""))
+
+
+@pytest.mark.parametrize("mode", MODES + ["P"])
+@pytest.mark.parametrize("size", SIZES)
+def test_strips_match_whole_image(tmp_path, mode, size):
+    path = str(tmp_path / "image.png")
+    random_image(mode, size).save(path)
+    assert PngStripReader.supported(path)
+    expected = np.asarray(Image.open(path))
+    # Strips of one row, an uneven height and the whole image all decode the same pixels
+    for rows in (1, 4, size[1]):
+        assert np.array_equal(read_strips(path, rows), expected)
+
+
+@pytest.mark.parametrize("bits", [1, 2, 4])
+def test_packed_palette_strips(tmp_path, bits):
+    path = str(tmp_path / "packed.png")
+    image = random_image("P", (13, 9))
+    image = Image.fromarray(np.asarray(image) % (1 << bits), "P")
+    image.putpalette(list(range(3 << bits)))
+    image.save(path, bits=bits)
+    with PngStripReader(path) as reader:
+        assert reader.bit_depth == bits
+    assert np.array_equal(read_strips(path, 2), np.asarray(Image.open(path)))
+
+
+@pytest.mark.parametrize("color_type", [0, 2, 4, 6])
+def test_all_filter_types(tmp_path, color_type):
+    path = str(tmp_path / "filtered.png")
+    channels = PngStream.CHANNELS[color_type]
+    pixels = np.random.default_rng(color_type).integers(0, 256, (11, 13, channels), dtype=np.uint8)
+    filtered_png(path, pixels, color_type)
+    expected = np.asarray(Image.open(path))
+    assert np.array_equal(expected.reshape(pixels.shape), pixels)
+    for rows in (1, 3, 11):
+        assert np.array_equal(read_strips(path, rows), expected)
+
+
+def test_interlaced_is_not_supported(tmp_path):
+    path = str(tmp_path / "interlaced.png")
+    header = struct.pack(">IIBBBBB", 4, 4, 8, 2, 0, 0, 1)
+    with open(path, "wb") as file:
+        file.write(PngStream.PNG_SIGNATURE + PngStream._chunk(b"IHDR", header) +
+                   PngStream._chunk(b"IDAT", zlib.compress(bytes(4 * 13 + 3 * 7 + 16))) +
+                   PngStream._chunk(b"IEND", b""))
+    assert not PngStripReader.supported(path)
+
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("size", SIZES)
+def test_writer_round_trip(tmp_path, mode, size):
+    path = str(tmp_path / "written.png")
+    image = random_image(mode, size)
+    pixels = np.asarray(image)
+    with PngStripWriter(path, size, compress_level=1) as writer:
+        for y in range(0, size[1], 4):
+            writer.write(Image.fromarray(pixels[y:y + 4], mode))
+    decoded = Image.open(path)
+    assert decoded.mode == mode
+    assert np.array_equal(np.asarray(decoded), pixels)
+    assert np.array_equal(read_strips(path, 3), pixels)
+
+
+def test_writer_leaves_nothing_behind_when_incomplete(tmp_path):
+    path = str(tmp_path / "incomplete.png")
+    with pytest.raises(ValueError):
+        with PngStripWriter(path, (13, 9)) as writer:
+            writer.write(random_image("RGB", (13, 4)))
+    assert os.listdir(tmp_path) == []
+
+
+def test_rewrite_palette(tmp_path):
+    path, output_path = str(tmp_path / "indexed.png"), str(tmp_path / "recolored.png")
+    image = random_image("P", (31, 17))
+    image.save(path)
+
+    def recolor(colors, alpha):
+        colors, alpha = colors.copy(), alpha.copy()
+        colors[3] = (1, 2, 3)
+        alpha[5] = 0
+        return colors, alpha
+
+    rewrite_palette(path, output_path, recolor)
+    recolored = Image.open(output_path)
+    # The image data is copied as it is, only the palette and transparency change
+    assert np.array_equal(np.asarray(recolored), np.asarray(image))
+    palette = np.array(recolored.getpalette()[:48]).reshape(-1, 3)
+    assert tuple(palette[3]) == (1, 2, 3)
+    assert np.array_equal(np.delete(palette, 3, axis=0), np.delete(np.array(image.getpalette()[:48]).reshape(-1, 3),
+                                                                    3, axis=0))
+    rgba = np.asarray(recolored.convert("RGBA"))
+    indices = np.asarray(image)
+    assert (rgba[indices == 5, 3] == 0).all() and (rgba[indices != 5, 3] == 255).all()
+    assert sorted(os.listdir(tmp_path)) == ["indexed.png", "recolored.png"]
+
+
+def test_rewrite_palette_rejects_non_indexed(tmp_path):
+    path, output_path = str(tmp_path / "rgb.png"), str(tmp_path / "out.png")
+    random_image("RGB", (13, 9)).save(path)
+    with pytest.raises(ValueError):
+        rewrite_palette(path, output_path, lambda colors, alpha: (colors, alpha))
+    # The temporary .partial file is removed too
+    assert os.listdir(tmp_path) == ["rgb.png"]